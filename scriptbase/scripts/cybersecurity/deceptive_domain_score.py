@@ -1,12 +1,27 @@
 import argparse
+import collections
+import concurrent.futures
+import csv
+import functools
+import gc
+import itertools
+import json
 import logging
+import multiprocessing
 import os
+import pickle
 import re
+import signal
+import socketserver
+import stat
+import sys
 
-from typing import Iterator, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 from scriptbase import SCRIPTBASE_DIRECTORY
 import scriptbase.utils.algorithms.edit_distance as edit_distance
+import scriptbase.utils.algorithms.edit_distance_trie as edit_distance_trie
+import scriptbase.utils.algorithms.qgram_index as qgram_index
 import scriptbase.utils.file_handling.file_utils as file_utils
 
 
@@ -14,23 +29,65 @@ REPEATED_NONALPHANUMERIC_CHARACTERS = r"(([^a-zA-Z\d\s:])\2)"
 UNNECESSARY_NUMBERS_PATTERN = r"([\d]){3,}"
 HTTP_HTTPS_PATTERN = r"(^https:\/\/www\.)|(^http:\/\/www\.)|(^https:\/\/)|(^http:\/\/)|(^www\.)"
 
+OUTPUT_FIELDS = ("domain", "score", "closest_match", "distance", "matched_token", "error")
+
+# Multiplier applied to the score for each edit distance between the domain and a company.
+# Any larger distance scores 0, so companies further away than MATCH_DISTANCE never need comparing
+EDIT_DISTANCE_WEIGHTINGS = {0: 1.2, 1: 1.1, 2: 0.5}
+MATCH_DISTANCE = max(EDIT_DISTANCE_WEIGHTINGS)
+
+# Length of the q-grams CompanyIndex filters names with. With MATCH_DISTANCE = 2, bigrams can rule out
+# names of 6 or more characters, while trigrams could only rule out names of 9 or more
+COMPANY_QGRAM_LENGTH = 2
+
+## Bump whenever the layout of CompanyIndex changes, so old cached indexes are rebuilt
+COMPANY_INDEX_VERSION = 3
+
 this_logger = logging.getLogger(__name__)
 
+# Company index used by worker processes, see score_domains
+_worker_company_index = None
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description="Computes the deceptive domain score for a given domain.")
 
-    parser.add_argument("-d", "--domain", help="Domain name to compute score for", required=True)
+    domain_source = parser.add_mutually_exclusive_group(required=True)
+    domain_source.add_argument("-d", "--domain", help="Domain name to compute score for")
+    domain_source.add_argument("--input", help="File with one domain per line to score, or - to read from stdin. "
+                                               "Domains are streamed, so the file can be arbitrarily large")
+    domain_source.add_argument("--serve", help="Keep the company index loaded and answer requests on a local "
+                                               "socket: either the path of a Unix socket or host:port for TCP. "
+                                               "Each request is a line containing a domain, {\"domain\": ...} or "
+                                               "{\"domains\": [...]}, and is answered with a line of JSON",
+                               metavar="ADDRESS")
     parser.add_argument("-c", "--company-data", help="Path to a CSV file containing company data to compare against. "
                                                      "Two columns required (no headers): second-level domain and "
                                                      "top-level domain",
                         default=os.path.join(SCRIPTBASE_DIRECTORY, "examples/demo_files/company_data.csv"))
+    parser.add_argument("--index-cache", help="Folder to keep the index built from the company data in, so it is "
+                                              "only rebuilt when the CSV changes. Pass an empty string to disable",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "scriptbase", "deceptive_domain_score"))
     parser.add_argument("-q", "--quiet", help="Significantly reduces logging output; "
                                               "just prints the score", action="store_true")
     parser.add_argument("--see-closest-match", help="Shows the closest match even when the score is below "
                                                     "the threshold.", action="store_true")
     parser.add_argument("--threshold", help="Sets the threshold for declaring a website worthy of further review. "
                                             "Defaults to 5.", default=5, type=int)
+    parser.add_argument("--output", help="With --input, where to write the results. Defaults to stdout",
+                        default="-")
+    parser.add_argument("--output-format", help="With --input, whether to write the results as CSV (with a header) "
+                                                "or JSON lines. Defaults to csv", choices=["csv", "jsonl"],
+                        default="csv")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="With --input, number of processes to score domains with. Defaults to 1")
+    parser.add_argument("--chunk-size", type=int, default=256,
+                        help="With --jobs, number of domains sent to a process at a time. Defaults to 256")
+    parser.add_argument("--unordered", action="store_true",
+                        help="With --jobs, write results as soon as each chunk is scored rather than in input order")
+    parser.add_argument("--cache-size", type=int, default=65536,
+                        help="With --serve, number of recent results to keep, keyed by cleaned domain. "
+                             "Defaults to 65536")
 
     return parser.parse_args()
 
@@ -86,53 +143,147 @@ def tokenize(string_to_tokenize: str, length: int) -> Iterator[str]:
         yield string_to_tokenize[offset:offset + length]
 
 
-def minimum_token_edit_distance(second_level_domain: str,
-                                company_to_compare: str,
-                                lenience: int = 2) -> Tuple[int, str]:
+def minimum_token_edit_distance(second_level_domain: str, company_to_compare: str) -> Tuple[int, str]:
     """
-    Calculates the minimum Levenshtein distance for all tokens of second_level_domain of length
-    equal to the length of company_to_compare +/- the lenience
+    Calculates the minimum Levenshtein distance between company_to_compare and any token
+    (contiguous sub-string) of second_level_domain
 
-    The lenience allows extra characters to be added to the second_level_domain
-    relative to company_to_compare and still read an accurate edit score over a section.
+    Comparing against tokens rather than the whole domain allows extra characters around the company
+    name. For example, "american-express-update" is clearly based on "americanexpress": the token
+    "american-express" is 1 edit away, even though the whole domain is 8.
 
-    For example, "american-express-update" is clearly based on "americanexpress" but would
-    return an edit distance of 2 for the comaprison of "american-expres" and "americanexpress"
-    when the better comparison of "american-express" and "americanexpress" returns 1 - this would require
-    a lenience of at least 1.
+    The tokens aren't generated one by one: a single semi-global alignment finds the best token
+    (see edit_distance.substring_edit_distance). A token within distance d of the company differs
+    from it in length by at most d, so this finds the same distances as comparing every token of
+    length len(company_to_compare) +/- d.
 
     Parameters:
         second_level_domain (str): Second-level domain name to check
         company_to_compare (str): Company to check the second level domain name against
-        lenience (int): Amount of length to fudge the token length by to allow for more accurate edit distance
-                        calculation. Assumed to be positive. Defaults to 2
 
     Returns:
         Tuple[int, str]: Tuple containing the minimum edit distance found alongside the token that created it
     """
 
-    lenience = abs(lenience)
+    distance, start, end = edit_distance.substring_edit_distance(second_level_domain, company_to_compare)
+    return distance, second_level_domain[start:end]
+
 
-    # Generators a list of iterators
-    # Each iterator generates the valid tokens for a given length +/- the lenience
-    token_iterators = (tokenize(second_level_domain, len(company_to_compare) + fudge)
-                       for fudge in range(-lenience, lenience + 1))
+class CompanyIndex:
+    """
+    Company data prepared for scoring many domains.
 
-    # Generates a list of lists of tuple pair of (edit_distance: int, token: str)
-    # The token is returned alongside the int to allow description to the user of what is causing the low edit distance
-    # Each list in the list of lists represents the tokens of a different fudged length
-    edit_distance_list = ([(edit_distance.numeric_edit_distance(token, company_to_compare), token)
-                           for token in token_it]
-                          for token_it in token_iterators)
+    Only the companies that may be within MATCH_DISTANCE of some sub-string of a domain are
+    compared against it: every other company has a larger minimum_token_edit_distance and scores 0.
 
-    flattened_edit_distance_list = sum(edit_distance_list, [])
+    Company second-level domains long enough for the q-gram count filter to apply are kept in a
+    QGramIndex, and any sharing too few q-grams with the domain are skipped without computing an
+    edit distance. Shorter names, which the filter can't rule out, are kept in an EditDistanceTrie
+    that finds exactly those within MATCH_DISTANCE.
+    """
 
-    return min(flattened_edit_distance_list, key=lambda t: t[0])
+    def __init__(self, company_data: List[Tuple[str, str]]):
+        """
+        Parameters:
+            company_data (List[Tuple[str, str]]): List of company (second-level domain, top-level domain) tuples
+        """
+
+        self.company_data = [tuple(company) for company in company_data]
+
+        # Several companies can share a second-level domain (e.g. barclays.com and barclays.co.uk)
+        self.company_ids_by_name: Dict[str, List[int]] = {}
+        for company_id, company in enumerate(self.company_data):
+            self.company_ids_by_name.setdefault(company[0], []).append(company_id)
+
+        self.name_qgrams = qgram_index.QGramIndex(q=COMPANY_QGRAM_LENGTH)
+        self.name_trie = edit_distance_trie.EditDistanceTrie()
+        for name in self.company_ids_by_name:
+            if self.name_qgrams.required_shared(len(name), MATCH_DISTANCE) > 0:
+                self.name_qgrams.add(name)
+            else:
+                self.name_trie.add(name)
+
+    @classmethod
+    def from_csv(cls, csv_path: str, cache_dir: Optional[str] = None) -> 'CompanyIndex':
+        """
+        Builds the index for a company CSV (see parse_args), reusing the copy pickled in cache_dir
+        if it was built from a CSV with the same contents
+
+        Parameters:
+            csv_path (str): Path to the company CSV
+            cache_dir (Optional[str]): Folder to keep built indexes in, or None to always build it
+
+        Returns:
+            CompanyIndex: Index of the companies in the CSV
+        """
+
+        if cache_dir is None:
+            return cls(file_utils.get_csv_contents(csv_path))
+
+        index_path = os.path.join(cache_dir, f"company_index-{file_utils.file_digest(csv_path)[:16]}.pickle")
+        try:
+            with open(index_path, "rb") as F:
+                version, company_index = pickle.load(F)
+            if version == COMPANY_INDEX_VERSION:
+                return company_index
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, TypeError, ValueError):
+            pass
+
+        company_index = cls(file_utils.get_csv_contents(csv_path))
+
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = index_path + ".tmp"
+        with open(temporary_path, "wb") as F:
+            pickle.dump((COMPANY_INDEX_VERSION, company_index), F, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, index_path)
+
+        return company_index
+
+    def candidates(self, second_level_domain: str, max_distance: int = MATCH_DISTANCE) -> List[int]:
+        """
+        Finds the companies whose minimum_token_edit_distance to second_level_domain may be at most max_distance.
+        The trie finds exactly those companies among the short names, and the count filter a superset of
+        them among the rest.
+
+        Parameters:
+            second_level_domain (str): Second-level domain to find companies for
+            max_distance (int): Largest distance to find companies within
+
+        Returns:
+            List[int]: Sorted ids of candidate companies
+        """
+
+        company_ids = set()
+        for _, name in self.name_trie.search_substrings(second_level_domain, max_distance):
+            company_ids.update(self.company_ids_by_name[name])
+        for name in self.name_qgrams.count_filter(second_level_domain, max_distance):
+            company_ids.update(self.company_ids_by_name[name])
+
+        return sorted(company_ids)
 
 
 def phish_target_score(domain_to_check: Tuple[str, str],
                        company_data: List[Tuple[str, str]]) -> Tuple[float, Tuple[str, str]]:
     """
+    Computes the phish target score of a domain, see closest_phish_target
+
+    Parameters:
+        domain_to_check (Tuple[str, str]): Domain to compute phish target score for
+        company_data (List[Tuple[str, str]]): List of company domains that might be targeted for phishing
+
+    Returns:
+        Tuple[float, Tuple[str, str]]: Tuple of floating point score from 0 to 10 describing phish target score
+                                       and the closest company matched
+    """
+
+    score, closest_company_match, _ = closest_phish_target(domain_to_check, company_data)
+    return score, closest_company_match
+
+
+def closest_phish_target(domain_to_check: Tuple[str, str],
+                         company_data: List[Tuple[str, str]],
+                         company_index: Optional[CompanyIndex] = None) -> Tuple[float, Tuple[str, str], Tuple[int, str]]:
+    """
     Computes the phish target score of an ordered domain tuple consisting of:
         1) second-level domain
         2) top-level domain
@@ -156,13 +307,16 @@ def phish_target_score(domain_to_check: Tuple[str, str],
     Parameters:
         domain_to_check (Tuple[str, str]): Domain to compute phish target score for
         company_data (List[Tuple[str, str]]): List of company domains that might be targeted for phishing
+        company_index (Optional[CompanyIndex]): Index of company_data. If given, only companies that can score
+                                                above 0 are compared
 
     Returns:
-        Tuple[float, Tuple[str, str]]: Tuple of floating point score from 0 to 10 describing phish target score
-                                       and the closest company matched
+        Tuple[float, Tuple[str, str], Tuple[int, str]]: Tuple of floating point score from 0 to 10 describing phish
+                                                        target score, the closest company matched and the
+                                                        (edit distance, token) it was matched with
     """
     # TODO: Make parameters configurable
-    edit_distance_weightings = {0: 1.2, 1: 1.1, 2: 0.5}
+    edit_distance_weightings = EDIT_DISTANCE_WEIGHTINGS
     subsection_size_weighting = 0.6
     top_level_domain_same_weightings = {True: 1, False: 0.9}
     top_level_domain_is_com = {True: 0.8, False: 1}
@@ -181,12 +335,329 @@ def phish_target_score(domain_to_check: Tuple[str, str],
 
         return min(score, 10)
 
+    if company_index is not None:
+        # Keep company_data order so ties are broken the same way as without the index.
+        # If nothing scores above 0, every company ties and the first one is the match, so it is always compared
+        candidate_ids = company_index.candidates(domain_to_check[0])
+        if not candidate_ids or candidate_ids[0] != 0:
+            candidate_ids.insert(0, 0)
+        company_data = [company_data[company_id] for company_id in candidate_ids]
+
     # Generator for (company_tuple, (edit_distance, token))
     # (for an explanation of the latter part of tuple, see minimum_token_edit_distance)
     comparisons = ((company, minimum_token_edit_distance(domain_to_check[0], company[0])) for company in company_data)
     closest_company_match, (distance, token) = max(comparisons, key=lambda t: calculate_score(*t))
 
-    return calculate_score(closest_company_match, (distance, token)), closest_company_match
+    return calculate_score(closest_company_match, (distance, token)), closest_company_match, (distance, token)
+
+
+def score_cleaned_domain(cleaned_domain: str, company_index: CompanyIndex) -> dict:
+    """
+    Scores a domain that has already been through clean_input. The score only depends on the cleaned
+    domain, so this is what --serve caches.
+
+    Parameters:
+        cleaned_domain (str): Cleaned domain name to score
+        company_index (CompanyIndex): Companies that might be targeted for phishing
+
+    Returns:
+        dict: Result with a value for each of OUTPUT_FIELDS, except "domain"
+    """
+
+    result = dict.fromkeys(OUTPUT_FIELDS, None)
+
+    domain = cleaned_domain.split(".", 1)
+    if len(domain) < 2 or not domain[0]:
+        result["error"] = "Domain must contain a second-level and top-level domain"
+        return result
+
+    score, closest_company_match, (distance, token) = closest_phish_target(domain, company_index.company_data,
+                                                                           company_index)
+    result["score"] = round(score, 2)
+    result["closest_match"] = ".".join(closest_company_match)
+    result["distance"] = distance
+    result["matched_token"] = token
+    return result
+
+
+def score_domain(website_url: str, company_index: CompanyIndex) -> dict:
+    """
+    Scores a single domain for batch output. Any failure is reported in the result's "error" rather
+    than raised, so one bad line can't stop a batch
+
+    Parameters:
+        website_url (str): Domain name to score
+        company_index (CompanyIndex): Companies that might be targeted for phishing
+
+    Returns:
+        dict: Result with a value for each of OUTPUT_FIELDS
+    """
+
+    try:
+        cleaned_domain, _ = clean_input(website_url)
+        result = score_cleaned_domain(cleaned_domain, company_index)
+    except Exception as e:
+        this_logger.warning(f"Could not score {website_url}: {e!r}")
+        result = dict.fromkeys(OUTPUT_FIELDS, None)
+        result["error"] = f"Could not score domain: {e!r}"
+    result["domain"] = website_url
+    return result
+
+
+def _set_worker_company_index(company_index: 'CompanyIndex'):
+    global _worker_company_index
+    _worker_company_index = company_index
+
+
+def _score_chunk(domains: List[str]) -> List[dict]:
+    return [score_domain(domain, _worker_company_index) for domain in domains]
+
+
+def score_domains(domains: Iterable[str], company_index: CompanyIndex, jobs: int = 1, chunk_size: int = 256,
+                  ordered: bool = True) -> Iterator[dict]:
+    """
+    Scores domains (see score_domain), on a process pool if jobs is above 1.
+
+    Domains are sent to the workers in chunks, and only a few chunks per worker are in flight at once,
+    so memory use doesn't grow with the number of domains. The company index is never pickled per task:
+    where processes are forked, workers inherit the parent's copy, and otherwise each worker
+    receives it once when it starts.
+
+    Parameters:
+        domains (Iterable[str]): Domains to score
+        company_index (CompanyIndex): Companies that might be targeted for phishing
+        jobs (int): Number of processes to score with
+        chunk_size (int): Number of domains sent to a process at a time
+        ordered (bool): Whether to yield results in the order of domains. Otherwise they are yielded
+                        as soon as their chunk is scored
+
+    Yields:
+        dict: Result for each domain
+    """
+
+    if jobs <= 1:
+        for domain in domains:
+            yield score_domain(domain, company_index)
+        return
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        _set_worker_company_index(company_index)
+        # Move everything allocated so far out of the garbage collector's reach, so collections in
+        # the workers don't write to (and so copy) the pages holding the shared index
+        gc.freeze()
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                          mp_context=multiprocessing.get_context("fork"))
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_set_worker_company_index,
+                                                          initargs=(company_index,))
+
+    max_in_flight = jobs * 4
+    domain_iterator = iter(domains)
+    chunks = iter(lambda: list(itertools.islice(domain_iterator, chunk_size)), [])
+
+    try:
+        with executor:
+            pending = collections.deque()
+            while True:
+                while len(pending) < max_in_flight:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append(executor.submit(_score_chunk, chunk))
+                if not pending:
+                    break
+
+                if ordered:
+                    yield from pending.popleft().result()
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield from future.result()
+    finally:
+        gc.unfreeze()
+
+
+def read_domains(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the domain on each non-empty line, stripped of whitespace
+    """
+
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def write_results(results: Iterable[dict], output: TextIO, output_format: str = "csv") -> int:
+    """
+    Writes batch results as they are produced
+
+    Parameters:
+        results (Iterable[dict]): Results from score_domain
+        output (TextIO): File to write to
+        output_format (str): "csv" (with a header row) or "jsonl"
+
+    Returns:
+        int: Number of results written
+    """
+
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(result):
+            output.write(json.dumps(result) + "\n")
+
+    count = 0
+    for result in results:
+        write(result)
+        count += 1
+    return count
+
+
+def score_stream(input_path: str, output_path: str, company_index: CompanyIndex, output_format: str = "csv",
+                 jobs: int = 1, chunk_size: int = 256, ordered: bool = True) -> int:
+    """
+    Scores every domain in input_path (one per line) and writes the results to output_path.
+    Only one line (or with jobs, a few chunks per process) is held in memory at a time. Either path may
+    be "-" for stdin/stdout.
+
+    Parameters:
+        input_path (str): File to read domains from
+        output_path (str): File to write results to
+        company_index (CompanyIndex): Companies that might be targeted for phishing
+        output_format (str): "csv" or "jsonl"
+        jobs (int): Number of processes to score with, see score_domains
+        chunk_size (int): Number of domains sent to a process at a time
+        ordered (bool): Whether to write results in input order
+
+    Returns:
+        int: Number of domains scored
+    """
+
+    input_file = sys.stdin if input_path == "-" else open(input_path, "r")
+    output_file = sys.stdout if output_path == "-" else open(output_path, "w", newline="")
+    try:
+        results = score_domains(read_domains(input_file), company_index, jobs, chunk_size, ordered)
+        return write_results(results, output_file, output_format)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+
+class ScoringRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers each line sent over a --serve connection with a line of JSON:
+        example.com                       -> result (see score_domain)
+        {"domain": "example.com"}         -> result
+        {"domains": ["a.com", "b.net"]}   -> {"results": [result, ...]}
+    Malformed requests, and requests that fail for any other reason, are answered with {"error": ...}
+    and the connection stays open.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode("utf-8", errors="replace").strip()
+            if not line:
+                continue
+            try:
+                response = self.server.answer(line)
+            except KeyError as e:
+                response = {"error": f"Bad request: missing {e}"}
+            except (ValueError, TypeError, AttributeError) as e:
+                response = {"error": f"Bad request: {e}"}
+            except Exception as e:
+                # Whatever goes wrong with one request, the client still gets an answer and keeps its connection
+                this_logger.exception(f"Failed to answer {line!r}")
+                response = {"error": f"Could not score request: {e!r}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class ScoringServerMixin:
+    """
+    State shared by the --serve servers: the warm company index and an LRU cache of results
+    keyed by cleaned domain
+    """
+
+    # Scoring is CPU-bound, so threads only let slow clients overlap, but they keep one slow client
+    # from blocking the rest
+    daemon_threads = True
+
+    def setup_scoring(self, company_index: CompanyIndex, cache_size: int):
+        self.company_index = company_index
+        self.cached_score: Callable[[str], dict] = functools.lru_cache(maxsize=cache_size)(
+            functools.partial(score_cleaned_domain, company_index=company_index))
+
+    def score(self, website_url: str) -> dict:
+        if not isinstance(website_url, str):
+            raise TypeError("domains must be strings")
+        cleaned_domain, _ = clean_input(website_url.strip())
+        # The cached dictionary is shared between requests, so copy it before filling in the domain
+        result = dict(self.cached_score(cleaned_domain))
+        result["domain"] = website_url
+        return result
+
+    def answer(self, line: str):
+        if not line.startswith("{"):
+            return self.score(line)
+
+        request = json.loads(line)
+        if "domains" in request:
+            # A lone string would otherwise be scored one character at a time
+            if not isinstance(request["domains"], list):
+                raise TypeError("domains must be a list of strings")
+            return {"results": [self.score(website_url) for website_url in request["domains"]]}
+        return self.score(request["domain"])
+
+
+class UnixScoringServer(ScoringServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TCPScoringServer(ScoringServerMixin, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def serve(address: str, company_index: CompanyIndex, cache_size: int = 65536):
+    """
+    Answers scoring requests on a local socket until interrupted (see ScoringRequestHandler)
+
+    Parameters:
+        address (str): Path of a Unix socket, or host:port to listen on TCP
+        company_index (CompanyIndex): Companies that might be targeted for phishing
+        cache_size (int): Number of recent results to keep
+    """
+
+    host, _, port = address.rpartition(":")
+    try:
+        if host and port.isdigit():
+            server = TCPScoringServer((host, int(port)), ScoringRequestHandler)
+        else:
+            # A socket left behind by a previous run would make bind fail. Anything else at the path is left alone
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.remove(address)
+            server = UnixScoringServer(address, ScoringRequestHandler)
+    except OSError as e:
+        this_logger.critical(f"Could not listen on {address}: {e.strerror}")
+        exit()
+
+    server.setup_scoring(company_index, cache_size)
+    this_logger.info(f"Listening on {address}")
+
+    # Service managers stop daemons with SIGTERM; exiting through SystemExit still runs the cleanup below
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        this_logger.info("Shutting down")
+    finally:
+        if isinstance(server, UnixScoringServer) and os.path.exists(address):
+            os.remove(address)
 
 
 def string_entropy_score(domain_to_check: Tuple[str, str]) -> float:
@@ -201,23 +672,38 @@ def main():
 
     args = parse_args()
 
+    try:
+        company_index = CompanyIndex.from_csv(args.company_data, cache_dir=args.index_cache or None)
+    except FileNotFoundError as e:
+        this_logger.critical(f"Path does not exist: {args.company_data}")
+        exit()
+
+    if args.serve:
+        serve(args.serve, company_index, cache_size=args.cache_size)
+        return
+
+    if args.input:
+        try:
+            count = score_stream(args.input, args.output, company_index, args.output_format,
+                                 jobs=args.jobs, chunk_size=args.chunk_size, ordered=not args.unordered)
+        except FileNotFoundError as e:
+            this_logger.critical(f"Path does not exist: {e.filename}")
+            exit()
+        if not args.quiet:
+            this_logger.info(f"Scored {count} domains")
+        return
+
     domain, steps = clean_input(args.domain)
     domain = domain.split(".", 1)
 
-    if len(domain) < 2:
+    if len(domain) < 2 or not domain[0]:
         this_logger.critical(f"Domain must contain only second-level and top-level domain! E.g. google.com")
         exit()
 
     if "." in domain[1]:
         this_logger.warning(f"Assuming that {domain[1]} is a top-level domain!")
 
-    try:
-        company_data = file_utils.get_csv_contents(args.company_data)
-    except FileNotFoundError as e:
-        this_logger.critical(f"Path does not exist: {args.company_data}")
-        exit()
-
-    score, closest_company_matched = phish_target_score(domain, company_data)
+    score, closest_company_matched, _ = closest_phish_target(domain, company_index.company_data, company_index)
     score = round(score, 2)
 
     if args.quiet:
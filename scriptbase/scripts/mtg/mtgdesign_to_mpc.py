@@ -1,39 +1,75 @@
 import argparse
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
 import logging
 import os
 from PIL import Image
+import queue
 import re
+import threading
+import time
+
+from typing import Dict, List, NamedTuple, Optional
 
 import scriptbase.utils.file_handling.file_utils as file_utils
 import scriptbase.utils.file_handling.image_utils as image_utils
+import scriptbase.utils.file_handling.manifest as manifest
+import scriptbase.utils.file_handling.watcher as watcher
 import scriptbase.utils.magic_the_gathering.cockatrice as cockatrice
+import scriptbase.utils.profiling.stage_timing as stage_timing
 
 this_logger = logging.getLogger(__loader__.name)
 
 ## Various global coordinates that can be configured if necessary
-ARTIST_X_RANGE = range(140, 320)
-ARTIST_Y_RANGE = range(990, 1013)
+## Regions are rectangles of (x0, y0, x1, y1), with x1 and y1 exclusive
+ARTIST_RECT = (140, 990, 320, 1013)
 
-ARTIST_X_RANGE_POST_MPC_READY = range(103, 342)
-ARTIST_Y_RANGE_POST_MPC_READY = range(1018, 1040)
+ARTIST_RECT_POST_MPC_READY = (103, 1018, 342, 1040)
 
-ARTIST_X_RANGE_PLANESWALKER_POST_MPC_READY = range(80, 130)
-ARTIST_Y_RANGE_PLANESWALKER_POST_MPC_READY = range(1005, 1030)
+ARTIST_RECT_PLANESWALKER_POST_MPC_READY = (80, 1005, 130, 1030)
 
-COPYRIGHT_X_RANGE = range(440, 698)
-COPYRIGHT_Y_RANGE_CREATURE = range(986, 1000)
-COPYRIGHT_Y_RANGE_NONCREATURE = range(969, 984)
+COPYRIGHT_RECT_CREATURE = (440, 986, 698, 1000)
+COPYRIGHT_RECT_NONCREATURE = (440, 969, 698, 984)
 
-CORNER_RANGES = [(range(0, 35), range(0, 34)),
-                 (range(710, 744), range(0, 34)),
-                 (range(0, 35), range(1006, 1039)),
-                 (range(708, 744), range(1006, 1039))]
+CORNER_RECTS = [(0, 0, 35, 34),
+                (710, 0, 744, 34),
+                (0, 1006, 35, 1039),
+                (708, 1006, 744, 1039)]
+CORNER_NAMES = ["top left corner", "top right corner", "bottom left corner", "bottom right corner"]
 
-NOT_FOR_SALE_X_RANGE = range(168, 276)
-NOT_FOR_SALE_Y_RANGE = range(972, 988)
+NOT_FOR_SALE_RECT = (168, 972, 276, 988)
 
 MPC_ADJUSTED_DIMENSIONS = (816, 1110)
 
+## A3 at 300 DPI
+DEFAULT_SHEET_DIMENSIONS = (3508, 4961)
+
+MANIFEST_FILENAME = ".mtg_to_mpc_manifest.json"
+
+
+class CardJob(NamedTuple):
+    """
+    Everything needed to process one card, kept small so it is cheap to send to a worker process.
+    A job with regions set to None is a card that has already been processed, and only needs
+    image_path placing on the print sheet.
+
+    copies holds the output paths of duplicates of this card (see dedupe_jobs): they are linked to
+    output_path rather than processed again, and each one is placed on the print sheet too.
+    """
+
+    image_path: str
+    output_path: Optional[str]
+    regions: tuple
+    bleed: Optional[str]
+    return_image: bool = False
+    save_options: tuple = ()
+    profile: bool = False
+    copies: tuple = ()
+
 
 def parse_args():
 
@@ -44,8 +80,13 @@ def parse_args():
     parser.add_argument("-i", "--input", help="Location of folder containing card images", required=True)
     parser.add_argument("-v", "--valid-extensions", default=["jpg", "png"], help="List of valid image extensions",
                         nargs='+')
-    parser.add_argument("-c", "--cockatrice-xml", help="More accurately erase copyright by passing a cockatrice XML "
-                                                       "of the set")
+    parser.add_argument("-c", "--cockatrice-xml", help="More accurately erase copyright by passing cockatrice XMLs "
+                                                       "of the set. If a card is in more than one, the last XML wins",
+                        nargs='+')
+    parser.add_argument("--cockatrice-cache", help="Folder to keep parsed snapshots of cockatrice XMLs in, so "
+                                                   "unchanged XMLs don't have to be parsed again. Pass an empty "
+                                                   "string to disable",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "scriptbase", "cockatrice"))
     parser.add_argument("-r", "--regex-name-match", help="Fancy name matching to extract a card name from a file name, "
                                                          "e.g. [\d]+_(.+)",
                         default="(.+)")
@@ -62,10 +103,810 @@ def parse_args():
                         action="store_true")
     parser.add_argument("-C", "--scrub-copyright", help="Erases the WOTC copyright information from the card",
                         action="store_true")
+    parser.add_argument("--bleed", choices=image_utils.BLEED_METHODS,
+                        help="Pads each card to the MPC dimensions by extending its edge pixels outwards, either by "
+                             "replicating the outermost pixels or mirroring the pixels next to the edge")
+    parser.add_argument("--sheets", help="Also lays the processed cards out on print sheets, saved to this folder")
+    parser.add_argument("--sheets-only", help="Only saves the print sheets, not the individual card images "
+                                              "(requires --sheets)", action="store_true")
+    parser.add_argument("--sheet-size", nargs=2, type=int, default=list(DEFAULT_SHEET_DIMENSIONS),
+                        help="Size of a print sheet in pixels. Defaults to A3 at 300 DPI")
+    parser.add_argument("--sheet-card-size", nargs=2, type=int, default=list(MPC_ADJUSTED_DIMENSIONS),
+                        help="Size of a card on the print sheet in pixels. Defaults to the MPC dimensions")
+    parser.add_argument("--sheet-margin", type=int, default=60,
+                        help="Blank border around the cards on a print sheet in pixels")
+    parser.add_argument("--sheet-spacing", type=int, default=0,
+                        help="Gap between neighbouring cards on a print sheet in pixels")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes to process cards with. Defaults to 1")
+    parser.add_argument("--pipelined", help="Overlaps reading, processing and saving cards: a reader thread "
+                                            "prefetches files, worker threads decode and scrub them and a writer "
+                                            "thread encodes and saves them", action="store_true")
+    parser.add_argument("--pipeline-threads", type=int, default=2,
+                        help="Number of decode/scrub threads used with --pipelined. Defaults to 2")
+    parser.add_argument("--pipeline-depth", type=int, default=8,
+                        help="Maximum number of cards held in memory at once with --pipelined. Defaults to 8")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(0, 10), metavar="[0-9]",
+                        help="PNG compression level, from 0 (none, fastest) to 9 (smallest). Defaults to 6")
+    parser.add_argument("--optimize", help="Makes the PNG encoder search for the smallest output. Much slower",
+                        action="store_true")
+    parser.add_argument("--fast", help="Preset for quick turnaround: PNG compression level 1 without --optimize",
+                        action="store_true")
+    parser.add_argument("--profile-report", help="Records how long each card spends in each stage (decoding, "
+                                                 "database lookup, each scrub region, encoding) alongside file sizes "
+                                                 "and peak memory, writes it to this JSON file and logs a summary")
+    parser.add_argument("--dedupe", help="Hashes the input files first and processes byte-identical cards only once, "
+                                         "hard linking (or copying) the result for the duplicates",
+                        action="store_true")
+    parser.add_argument("--dedupe-pixels", help="Like --dedupe, but compares decoded pixels, so the same image saved "
+                                                "differently also counts as a duplicate. Slower to hash",
+                        action="store_true")
     parser.add_argument("--raise-errors", help="Raises the errors in full rather than silencing them and proceeding.",
                         action="store_true")
+    parser.add_argument("--force", help="Reprocesses every card, even those the manifest says are up to date",
+                        action="store_true")
+    parser.add_argument("--prune", help="Deletes outputs whose input files no longer exist", action="store_true")
+    parser.add_argument("--watch", help="Keeps running after the first pass, processing new or changed card images "
+                                        "as they appear in the input folder", action="store_true")
+    parser.add_argument("--poll-interval", help="Seconds between checks of the input folder in --watch mode",
+                        default=1.0, type=float)
+    parser.add_argument("--settle-time", help="Seconds a file must stay unchanged before it is processed in --watch "
+                                              "mode, so partially written files are skipped", default=2.0, type=float)
+
+    args = parser.parse_args()
+
+    if args.fast:
+        args.compress_level = 1
+        args.optimize = False
+
+    return args
+
+
+def save_options(args) -> tuple:
+    """
+    Returns the keyword arguments for Image.save as a tuple of (name, value) pairs, so they can be
+    part of a CardJob and a card_pipeline cache key
+    """
+
+    return ("compress_level", args.compress_level), ("optimize", args.optimize)
+
+
+def settings_digest(args, card_is_creature: bool) -> str:
+    """
+    Computes a digest of every setting that affects the output image of a card, so that
+    the manifest can tell when a card needs to be reprocessed because the settings changed
+
+    Parameters:
+        args (argparse.Namespace): Parsed command line arguments
+        card_is_creature (bool): Whether the card uses the creature layout
+
+    Returns:
+        str: Hex digest of the effective settings
+    """
+
+    settings = {
+        "scrub_artist": args.scrub_artist,
+        "scrub_copyright": args.scrub_copyright,
+        "scrub_corners": args.scrub_corners,
+        "scrub_not_for_sale": args.scrub_not_for_sale,
+        "corner_scrub_color": args.corner_scrub_color,
+        "card_is_creature": card_is_creature,
+        "bleed": args.bleed,
+        "regions": [ARTIST_RECT_POST_MPC_READY, COPYRIGHT_RECT_CREATURE, COPYRIGHT_RECT_NONCREATURE,
+                    CORNER_RECTS, NOT_FOR_SALE_RECT],
+        "mpc_dimensions": MPC_ADJUSTED_DIMENSIONS,
+        "save_options": dict(save_options(args)),
+    }
+
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_card_name(image_path: str, regex_name_match: str):
+    """
+    Extracts the card name from an image path using the name matching regex
+
+    Parameters:
+        image_path (str): Path to the card image
+        regex_name_match (str): Regex whose first capture group is the card name
+
+    Returns:
+        Optional[str]: Card name, or None if the file name does not match
+    """
+
+    im_filename = os.path.splitext(os.path.basename(image_path))[0]
+    card_name_match = re.match(regex_name_match, im_filename)
+    if not card_name_match:
+        return None
+    return card_name_match.group(1)
+
+
+def get_output_path(image_path: str, output_folder: str) -> str:
+    """
+    Returns the path the processed version of image_path is saved to
+    """
+
+    im_filename = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_folder, im_filename) + ".png"
+
+
+def is_creature_layout(card_name: str, cockatrice_database) -> bool:
+    """
+    Decides whether a card uses the creature layout (which moves the copyright line).
+    Cards are assumed to be creatures unless the cockatrice database says otherwise.
+
+    Parameters:
+        card_name (str): Name of the card
+        cockatrice_database (Optional[cockatrice.CockatriceDatabase]): Database to look the card up in
+
+    Returns:
+        bool: True if the card is a creature or planeswalker
+    """
+
+    if cockatrice_database is not None:
+        card = cockatrice_database.resolve_card_name(card_name)
+        if card is None:
+            this_logger.warning(f"--- Could not find {card_name} in the cockatrice database, "
+                                f"assuming it is a creature ---")
+        else:
+            if card.name != card_name:
+                this_logger.info(f"--- Resolved {card_name} to {card.name} ---")
+            return card.type.lower() == "creature" or card.type.lower() == "planeswalker"
+    return True
+
+
+def scrub_regions(args, card_is_creature: bool) -> tuple:
+    """
+    Works out which regions of the card need scrubbing, and with which color
+
+    Parameters:
+        args (argparse.Namespace): Parsed command line arguments
+        card_is_creature (bool): Whether the card uses the creature layout
+
+    Returns:
+        tuple: Tuple of (rect, color, name) triples to pass to image_utils.ImagePipeline.scrub. The name
+               labels the region in --profile-report
+    """
+
+    default_color = (0, 0, 0)
+    regions = []
+
+    if args.scrub_artist:
+        regions.append((ARTIST_RECT_POST_MPC_READY, default_color, "artist"))
+
+    if args.scrub_copyright:
+        if card_is_creature:
+            this_logger.info(f"--- Inputted file is a creature or planeswalker, "
+                             f"using a different range for removing "
+                             f"copyright ---")
+            regions.append((COPYRIGHT_RECT_CREATURE, default_color, "copyright"))
+        else:
+            this_logger.info(f"--- Inputted file is non-creature, using standard range for removing "
+                             f"copyright ---")
+            regions.append((COPYRIGHT_RECT_NONCREATURE, default_color, "copyright"))
+
+    if args.scrub_corners:
+        regions += [(rect, tuple(args.corner_scrub_color), name) for rect, name in zip(CORNER_RECTS, CORNER_NAMES)]
+
+    if args.scrub_not_for_sale:
+        regions.append((NOT_FOR_SALE_RECT, default_color, "not for sale"))
+
+    return tuple(regions)
+
+
+@functools.lru_cache(maxsize=None)
+def card_pipeline(regions: tuple, bleed: str = None, save_options: tuple = ()) -> image_utils.ImagePipeline:
+    """
+    Returns the image pipeline for cards that need the given regions scrubbed. Pipelines are
+    cached, so every card with the same layout shares one pipeline and its output buffer.
+
+    Parameters:
+        regions (tuple): Tuple of (rect, color, name) triples from scrub_regions
+        bleed (str): Bleed method used to pad the card to MPC_ADJUSTED_DIMENSIONS, or None to leave the size alone
+        save_options (tuple): (name, value) pairs of keyword arguments for Image.save
+
+    Returns:
+        image_utils.ImagePipeline: Pipeline that scrubs and saves a card
+    """
+
+    pipeline = image_utils.ImagePipeline().scrub(regions).save_options(**dict(save_options))
+    if bleed is not None:
+        pipeline.extend_bleed(*MPC_ADJUSTED_DIMENSIONS, method=bleed)
+    return pipeline
+
+
+def card_profile(timings: Optional[Dict[str, float]]) -> Optional[dict]:
+    """
+    Packages the stage timings of a card with the peak memory of the process that handled it,
+    or returns None if the card wasn't profiled
+    """
+
+    if timings is None:
+        return None
+    return {"timings": timings, "peak_rss": stage_timing.peak_rss_bytes()}
+
+
+def open_card(image_path: str, timings: Optional[Dict[str, float]] = None) -> Image.Image:
+    """
+    Opens and decodes a card image (or file object), timing it as the "open_decode" stage
+    """
+
+    with stage_timing.timed(timings, "open_decode"):
+        im = Image.open(image_path)
+        im.load()
+    return im
+
+
+def transform_card(job: CardJob, im: Image.Image, timings: Optional[Dict[str, float]] = None) -> Image.Image:
+    """
+    Scrubs a decoded card image and saves it to job.output_path, if set
+
+    Parameters:
+        job (CardJob): Card being processed
+        im (Image.Image): Decoded card image
+        timings (Optional[Dict[str, float]]): If given, the time spent in each stage is added to it
+
+    Returns:
+        Image.Image: Processed card, see image_utils.ImagePipeline.run
+    """
+
+    card_image = card_pipeline(job.regions, job.bleed, job.save_options).run(im, timings=timings)
+    save_card(job, card_image, timings)
+    return card_image
+
+
+def save_card(job: CardJob, card_image: Image.Image, timings: Optional[Dict[str, float]] = None):
+    """
+    Saves a processed card to job.output_path, if set, and links its duplicates to it
+
+    Parameters:
+        job (CardJob): Card being processed
+        card_image (Image.Image): Processed card
+        timings (Optional[Dict[str, float]]): If given, the time spent saving is added to it
+    """
+
+    if job.output_path is None:
+        return
+
+    with stage_timing.timed(timings, "encode_save"):
+        # The output may be a link shared with a duplicate from an earlier run
+        file_utils.break_hard_link(job.output_path)
+        card_image.save(job.output_path, **dict(job.save_options))
+
+    with stage_timing.timed(timings, "link_duplicates"):
+        for copy_path in job.copies:
+            if copy_path is not None:
+                file_utils.link_or_copy(job.output_path, copy_path)
+
+
+def image_to_data(image: Image.Image) -> tuple:
+    """
+    Returns what image_from_data needs to rebuild an image in another process: its mode, size, raw
+    pixels and, for palette images, its palette (raw pixels alone are only palette indexes)
+    """
+
+    palette = None
+    if image.palette is not None:
+        palette = image.palette.mode, image.getpalette(image.palette.mode)
+    return image.mode, image.size, image.tobytes(), palette
+
+
+def image_from_data(image_data: tuple) -> Image.Image:
+    """
+    Rebuilds an image from the output of image_to_data
+    """
+
+    mode, size, pixels, palette = image_data
+    image = Image.frombytes(mode, size, pixels)
+    if palette is not None:
+        palette_mode, palette_values = palette
+        image.putpalette(palette_values, palette_mode)
+    return image
+
+
+def run_card_job(job: CardJob):
+    """
+    Opens, scrubs and saves a single card image. This is what worker processes run, so it only
+    relies on the job itself.
+
+    Parameters:
+        job (CardJob): Card to process
 
-    return parser.parse_args()
+    Returns:
+        Tuple[Optional[tuple], Optional[dict]]:
+            The processed card (see image_to_data) if job.return_image is set, and
+            the card's profile (see card_profile) if job.profile is set
+    """
+
+    timings = {} if job.profile else None
+    with open_card(job.image_path, timings) as im:
+        card_image = transform_card(job, im, timings)
+        card_data = None
+        if job.return_image:
+            card_data = image_to_data(card_image)
+
+    return card_data, card_profile(timings)
+
+
+def process_card(job: CardJob, imposer: image_utils.SheetImposer = None) -> Optional[dict]:
+    """
+    Opens, scrubs and saves a single card image in this process
+
+    Parameters:
+        job (CardJob): Card to process
+        imposer (image_utils.SheetImposer): Print sheet to add the processed card to, if any
+
+    Returns:
+        Optional[dict]: The card's profile (see card_profile) if job.profile is set
+    """
+
+    timings = {} if job.profile else None
+    with open_card(job.image_path, timings) as im:
+        card_image = transform_card(job, im, timings)
+        if imposer is not None:
+            with stage_timing.timed(timings, "sheet"):
+                add_to_sheet(imposer, card_image, 1 + len(job.copies))
+
+    return card_profile(timings)
+
+
+def add_to_sheet(imposer: image_utils.SheetImposer, card_image: Image.Image, count: int = 1):
+    """
+    Adds count copies of a processed card to the print sheets, logging when a sheet is saved
+    """
+
+    for _ in range(count):
+        sheet_path = imposer.add(card_image)
+        if sheet_path is not None:
+            this_logger.warning(f"--- Saved print sheet {sheet_path} ---")
+
+
+def run_jobs_pipelined(jobs: List[CardJob], args, imposer: image_utils.SheetImposer = None):
+    """
+    Runs card jobs as a pipeline of threads, so that disk reads, decoding/scrubbing and
+    encoding/saving of different cards overlap rather than adding up:
+
+        reader thread -> read queue -> --pipeline-threads workers -> write queue -> writer thread
+
+    The writer saves cards (and adds them to the print sheet) in the order of jobs. At most
+    --pipeline-depth cards are between being read and being saved at any time, which caps memory.
+
+    Parameters:
+        jobs (List[CardJob]): Cards to process
+        args (argparse.Namespace): Parsed command line arguments
+        imposer (image_utils.SheetImposer): Print sheet to add each card to, if any
+
+    Yields:
+        Tuple[CardJob, Optional[Exception], Optional[dict]]: Each job alongside the error it raised, if any,
+                                                            and its profile (see card_profile)
+    """
+
+    depth = max(args.pipeline_depth, 1)
+    thread_count = max(args.pipeline_threads, 1)
+    read_queue = queue.Queue(maxsize=depth)
+    write_queue = queue.Queue(maxsize=depth)
+    results = queue.Queue()
+    in_flight = threading.Semaphore(depth)
+    stop = threading.Event()
+
+    def put(target_queue: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source_queue: queue.Queue):
+        while not stop.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def reader():
+        for sequence_number, job in enumerate(jobs):
+            while not in_flight.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            timings = {} if job.profile else None
+            try:
+                with stage_timing.timed(timings, "read"):
+                    with open(job.image_path, "rb") as F:
+                        item = (sequence_number, job, F.read(), None, timings)
+            except Exception as e:
+                item = (sequence_number, job, None, e, timings)
+            if not put(read_queue, item):
+                return
+        for _ in range(thread_count):
+            put(read_queue, None)
+
+    def worker():
+        while True:
+            item = get(read_queue)
+            if item is None:
+                return
+            sequence_number, job, data, error, timings = item
+            card_image = None
+            if error is None:
+                try:
+                    card_image = open_card(io.BytesIO(data), timings)
+                    if job.regions is not None:
+                        card_image = card_pipeline(job.regions, job.bleed, job.save_options).run(
+                            card_image, reuse_buffer=False, timings=timings)
+                except Exception as e:
+                    error = e
+            if not put(write_queue, (sequence_number, job, card_image, error, timings)):
+                return
+
+    def writer():
+        waiting = {}
+        next_sequence_number = 0
+        while next_sequence_number < len(jobs):
+            item = get(write_queue)
+            if item is None:
+                return
+            sequence_number, job, card_image, error, timings = item
+            waiting[sequence_number] = (job, card_image, error, timings)
+
+            while next_sequence_number in waiting:
+                job, card_image, error, timings = waiting.pop(next_sequence_number)
+                if error is None:
+                    try:
+                        if job.regions is not None:
+                            save_card(job, card_image, timings)
+                        if imposer is not None:
+                            with stage_timing.timed(timings, "sheet"):
+                                add_to_sheet(imposer, card_image, 1 + len(job.copies))
+                    except Exception as e:
+                        error = e
+                in_flight.release()
+                results.put((job, error, card_profile(timings)))
+                next_sequence_number += 1
+
+    threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=writer, daemon=True)]
+    threads += [threading.Thread(target=worker, daemon=True) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for _ in range(len(jobs)):
+            yield results.get()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def run_jobs(jobs: List[CardJob], args, imposer: image_utils.SheetImposer = None):
+    """
+    Runs card jobs, on a process pool if --jobs is above 1. Results are handled in the order
+    of jobs, so progress logging and print sheets stay in order however the workers finish.
+
+    Parameters:
+        jobs (List[CardJob]): Cards to process
+        args (argparse.Namespace): Parsed command line arguments
+        imposer (image_utils.SheetImposer): Print sheet to add each card to, if any
+
+    Yields:
+        Tuple[CardJob, Optional[Exception], Optional[dict]]: Each job alongside the error it raised, if any,
+                                                            and its profile (see card_profile)
+    """
+
+    def place_processed_card(job: CardJob):
+        with Image.open(job.image_path) as card_image:
+            add_to_sheet(imposer, card_image, 1 + len(job.copies))
+
+    if args.pipelined:
+        yield from run_jobs_pipelined(jobs, args, imposer)
+        return
+
+    if args.jobs <= 1:
+        for job in jobs:
+            try:
+                profile = None
+                if job.regions is None:
+                    place_processed_card(job)
+                else:
+                    profile = process_card(job, imposer)
+            except Exception as e:
+                yield job, e, None
+            else:
+                yield job, None, profile
+        return
+
+    # Only a few jobs per worker are in flight at once, so finished cards waiting
+    # for an earlier, slower card don't pile up in memory
+    max_in_flight = args.jobs * 4
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        pending = collections.deque()
+        job_iterator = iter(jobs)
+
+        try:
+            while True:
+                while len(pending) < max_in_flight:
+                    job = next(job_iterator, None)
+                    if job is None:
+                        break
+                    if job.regions is None:
+                        pending.append((job, None))
+                    else:
+                        pending.append((job, executor.submit(run_card_job, job)))
+                if not pending:
+                    break
+
+                job, future = pending.popleft()
+                try:
+                    profile = None
+                    if future is None:
+                        place_processed_card(job)
+                    else:
+                        card_data, profile = future.result()
+                        if imposer is not None:
+                            with stage_timing.timed(profile["timings"] if profile else None, "sheet"):
+                                if card_data is not None:
+                                    add_to_sheet(imposer, image_from_data(card_data), 1 + len(job.copies))
+                                else:
+                                    place_processed_card(job._replace(image_path=job.output_path))
+                except Exception as e:
+                    yield job, e, None
+                else:
+                    yield job, None, profile
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+
+def dedupe_jobs(jobs: List[CardJob], manifest_info: dict, args) -> List[CardJob]:
+    """
+    Finds cards whose input files are identical (by content hash, or by decoded pixels with
+    --dedupe-pixels) and that would be processed the same way, and folds each duplicate into
+    the copies of the first such card, so it is only decoded, scrubbed and encoded once.
+
+    Duplicates are placed on print sheets next to the card they duplicate.
+
+    Parameters:
+        jobs (List[CardJob]): Jobs to dedupe, in order
+        manifest_info (dict): Manifest details of each job to process (see process_files), updated
+                              so that each kept job also lists the manifest details of its duplicates
+        args (argparse.Namespace): Parsed command line arguments
+
+    Returns:
+        List[CardJob]: Jobs with duplicates removed
+    """
+
+    def content_digest(image_path: str) -> str:
+        if args.dedupe_pixels:
+            with Image.open(image_path) as im:
+                digest = hashlib.blake2b(f"{im.mode} {im.size}".encode("utf-8"))
+                digest.update(im.tobytes())
+                return digest.hexdigest()
+        return file_utils.file_digest(image_path, algorithm="blake2b")
+
+    first_jobs = {}
+    duplicates = {}
+    for job in jobs:
+        if job not in manifest_info:
+            continue
+        try:
+            key = (content_digest(job.image_path), job.regions, job.bleed)
+        except Exception as e:
+            this_logger.error(f"--- Could not hash {job.image_path} to look for duplicates, processing it anyway! {e}")
+            continue
+        if key in first_jobs:
+            duplicates.setdefault(first_jobs[key], []).append(job)
+        else:
+            first_jobs[key] = job
+
+    deduped_jobs = []
+    for job in jobs:
+        if job in duplicates:
+            this_logger.info(f"--- {job.image_path} has {len(duplicates[job])} duplicates, processing it once ---")
+            deduped_job = job._replace(copies=tuple(duplicate.output_path for duplicate in duplicates[job]))
+            manifest_key, digest, input_state, lookup_timings, _ = manifest_info.pop(job)
+            manifest_info[deduped_job] = (manifest_key, digest, input_state, lookup_timings,
+                                          [(duplicate, manifest_info.pop(duplicate)) for duplicate in duplicates[job]])
+            deduped_jobs.append(deduped_job)
+        elif job in manifest_info or job.regions is None:
+            deduped_jobs.append(job)
+
+    this_logger.warning(f"Found {sum(len(d) for d in duplicates.values())} duplicate cards")
+    return deduped_jobs
+
+
+def process_files(image_paths: List[str], args, cockatrice_database, card_manifest: manifest.Manifest,
+                  imposer: image_utils.SheetImposer = None, profile: dict = None):
+    """
+    Processes a batch of card images, skipping those the manifest says are up to date.
+    The manifest is saved once the batch is done, even if it is interrupted.
+
+    Card names, layouts and manifest checks are resolved here, so with --jobs the workers
+    only receive a CardJob and never need the cockatrice database.
+
+    With --sheets-only there are no card images on disk to reuse, so every card is processed.
+
+    Parameters:
+        image_paths (List[str]): Paths of the card images to process
+        args (argparse.Namespace): Parsed command line arguments
+        cockatrice_database (Optional[cockatrice.CockatriceDatabase]): Database used to pick the card layout
+        card_manifest (manifest.Manifest): Manifest of previously processed cards
+        imposer (image_utils.SheetImposer): Print sheet to add each card to, if any
+        profile (dict): If given, a record per processed card is appended to profile["cards"] and the
+                        time taken is added to profile["wall_seconds"] (see write_profile_report)
+
+    Returns:
+        List[Tuple[str, Exception]]: Paths of the files that failed alongside their errors
+    """
+
+    start_time = time.perf_counter()
+    skipped = 0
+    errors = []
+    jobs = []
+    manifest_info = {}
+
+    for image_path in image_paths:
+        try:
+            card_name = get_card_name(image_path, args.regex_name_match)
+            if card_name is None:
+                this_logger.error(f"--- Skipping {image_path} because it fails the card name regex match check. ---")
+                continue
+
+            lookup_timings = {} if profile is not None else None
+            with stage_timing.timed(lookup_timings, "database_lookup"):
+                card_is_creature = is_creature_layout(card_name, cockatrice_database)
+            manifest_key = os.path.relpath(image_path, args.input)
+            digest = settings_digest(args, card_is_creature)
+            if not (args.force or args.sheets_only) and card_manifest.is_current(manifest_key, image_path, digest):
+                this_logger.info(f"--- {image_path} is unchanged since the last run, skipping ---")
+                # Keep its place in the order so print sheets stay in order
+                jobs.append(CardJob(card_manifest.output_path(manifest_key), None, None, None))
+                skipped += 1
+                continue
+
+            output_path = None if args.sheets_only else get_output_path(image_path, args.output)
+            # Taken before processing, so a card re-exported meanwhile doesn't look up to date next time
+            input_state = card_manifest.input_state(image_path) if output_path is not None else None
+            job = CardJob(image_path, output_path, scrub_regions(args, card_is_creature), args.bleed,
+                          return_image=args.sheets_only and args.jobs > 1, save_options=save_options(args),
+                          profile=profile is not None)
+            jobs.append(job)
+            manifest_info[job] = (manifest_key, digest, input_state, lookup_timings, [])
+
+        except Exception as e:
+            if args.raise_errors:
+                raise e
+            this_logger.error(f"An error occurred! {e}")
+            errors.append((image_path, e))
+
+    # Unchanged cards only need to go through the pipeline if they are going on a print sheet
+    if imposer is None:
+        jobs = [job for job in jobs if job in manifest_info]
+
+    if args.dedupe or args.dedupe_pixels:
+        jobs = dedupe_jobs(jobs, manifest_info, args)
+
+    i = 0
+    processed = 0
+    to_process = len(manifest_info) + sum(len(info[4]) for info in manifest_info.values())
+    try:
+        for job, error, card_profile_data in run_jobs(jobs, args, imposer):
+            if job not in manifest_info:
+                continue
+
+            manifest_key, digest, input_state, lookup_timings, duplicates = manifest_info[job]
+            i += 1 + len(duplicates)
+            if error is not None:
+                if args.raise_errors:
+                    raise error
+                this_logger.error(f"({i}/{to_process}) An error occurred processing {job.image_path}! {error}")
+                errors.append((job.image_path, error))
+                errors += [(duplicate.image_path, error) for duplicate, _ in duplicates]
+                continue
+
+            this_logger.warning(f"({i}/{to_process}) Processed file {job.image_path}")
+            if job.output_path is not None:
+                card_manifest.record(manifest_key, job.image_path, job.output_path, digest, input_state)
+            for duplicate, (duplicate_key, duplicate_digest, duplicate_state, _, _) in duplicates:
+                this_logger.info(f"--- {duplicate.image_path} is a duplicate of {job.image_path} ---")
+                if duplicate.output_path is not None:
+                    card_manifest.record(duplicate_key, duplicate.image_path, duplicate.output_path, duplicate_digest,
+                                         duplicate_state)
+            processed += 1 + len(duplicates)
+
+            if profile is not None and card_profile_data is not None:
+                profile["cards"].append({
+                    "path": job.image_path,
+                    "input_size": os.path.getsize(job.image_path),
+                    "output_size": os.path.getsize(job.output_path) if job.output_path is not None else None,
+                    "timings": {**lookup_timings, **card_profile_data["timings"]},
+                    "peak_rss": card_profile_data["peak_rss"],
+                })
+    finally:
+        card_manifest.save()
+        if profile is not None:
+            profile["wall_seconds"] += time.perf_counter() - start_time
+
+    this_logger.warning(f"Processed {processed} files, skipped {skipped} unchanged files")
+    if errors:
+        this_logger.error(f"{len(errors)} files failed:")
+        for image_path, error in errors:
+            this_logger.error(f"--- {image_path}: {error}")
+
+    return errors
+
+
+def write_profile_report(profile: dict, report_path: str):
+    """
+    Summarizes the per-card records gathered by process_files, logs the summary and writes
+    both to report_path as JSON
+
+    Parameters:
+        profile (dict): Dictionary with a list of per-card records under "cards" and the total
+                        processing time under "wall_seconds"
+        report_path (str): Path of the JSON file to write
+    """
+
+    cards = profile["cards"]
+    wall_seconds = profile["wall_seconds"]
+
+    def size_summary(sizes: List[int]) -> dict:
+        sizes = sorted(sizes)
+        return {"total": sum(sizes), "p50": stage_timing.percentile(sizes, 50),
+                "p90": stage_timing.percentile(sizes, 90), "max": sizes[-1] if sizes else 0}
+
+    summary = {
+        "cards": len(cards),
+        "wall_seconds": wall_seconds,
+        "cards_per_second": len(cards) / wall_seconds if wall_seconds else 0.0,
+        "stages": stage_timing.summarize_stages(card["timings"] for card in cards),
+        "input_size": size_summary([card["input_size"] for card in cards]),
+        "output_size": size_summary([card["output_size"] for card in cards if card["output_size"] is not None]),
+        "peak_rss": max((card["peak_rss"] for card in cards if card["peak_rss"] is not None), default=None),
+    }
+
+    with open(report_path, "w", encoding="utf-8") as F:
+        json.dump({"summary": summary, "cards": cards}, F, indent=1)
+
+    this_logger.warning(f"============================================")
+    this_logger.warning(f"                 PROFILE                    ")
+    this_logger.warning(f"{summary['cards']} cards in {wall_seconds:.2f}s ({summary['cards_per_second']:.2f} cards/sec)")
+    for stage, stats in sorted(summary["stages"].items(), key=lambda t: -t[1]["total"]):
+        this_logger.warning(f"{stage}: total {stats['total']:.3f}s, p50 {stats['p50'] * 1000:.2f}ms, "
+                            f"p90 {stats['p90'] * 1000:.2f}ms, p99 {stats['p99'] * 1000:.2f}ms, "
+                            f"max {stats['max'] * 1000:.2f}ms")
+    if summary["peak_rss"] is not None:
+        this_logger.warning(f"Peak RSS: {summary['peak_rss'] / 2 ** 20:.1f} MiB")
+    this_logger.warning(f"Full report written to {report_path}")
+    this_logger.warning(f"============================================")
+
+
+def watch(args, cockatrice_database, card_manifest: manifest.Manifest, imposer: image_utils.SheetImposer = None,
+          profile: dict = None):
+    """
+    Processes new or changed card images as they appear in the input folder until interrupted.
+    The cockatrice database is loaded once and reused for every batch.
+
+    Parameters:
+        args (argparse.Namespace): Parsed command line arguments
+        cockatrice_database (Optional[cockatrice.CockatriceDatabase]): Database used to pick the card layout
+        card_manifest (manifest.Manifest): Manifest of previously processed cards
+        imposer (image_utils.SheetImposer): Print sheet to add each card to, if any
+        profile (dict): Profile to add each card's record to, see process_files
+    """
+
+    directory_watcher = watcher.DirectoryWatcher(args.input, args.valid_extensions,
+                                                 poll_interval=args.poll_interval,
+                                                 settle_time=args.settle_time)
+    this_logger.warning(f"Watching {args.input} for new or changed files "
+                        f"({'inotify' if directory_watcher.using_inotify else 'polling'}), press Ctrl+C to stop...")
+
+    try:
+        for batch in directory_watcher.watch():
+            process_files(batch, args, cockatrice_database, card_manifest, imposer, profile)
+    except KeyboardInterrupt:
+        this_logger.warning(f"Stopped watching {args.input}")
 
 
 def main():
@@ -86,11 +927,22 @@ def main():
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
+    if args.pipelined and args.jobs > 1:
+        this_logger.critical(f"--pipelined and --jobs cannot be used together!")
+        exit(1)
+
+    ## Verify sheet args
+    if args.sheets_only and not args.sheets:
+        this_logger.critical(f"--sheets-only requires a --sheets folder!")
+        exit(1)
+    if args.sheets and not os.path.exists(args.sheets):
+        os.makedirs(args.sheets)
+
     cockatrice_database = None
     if args.cockatrice_xml:
         this_logger.warning(f"LOADING COCKATRICE DATABASE...")
-        cockatrice_database = cockatrice.CockatriceDatabase()
-        cockatrice_database.parse_xml(path=args.cockatrice_xml)
+        cockatrice_database = cockatrice.CockatriceDatabase.load_many(args.cockatrice_xml, jobs=args.jobs,
+                                                                      cache_dir=args.cockatrice_cache or None)
 
     valid_files = file_utils.recursive_file_grab(args.valid_extensions, args.input)
     valid_files.sort()
@@ -105,60 +957,34 @@ def main():
         i += 1
     this_logger.warning(f"============================================")
 
-    i = 0
-    for image_path in valid_files:
-
-        i += 1
-        this_logger.warning(f"({i}/{total}) Processing file {image_path}...")
-
-        try:
-            im_filename = os.path.splitext(os.path.basename(image_path))[0]
-            card_name_match = re.match(args.regex_name_match, im_filename)
-            if not card_name_match:
-                this_logger.error(f"--- Skipping {im_filename} because it fails the card name regex match check. ---")
-                continue
-            card_name = card_name_match.group(1)
+    card_manifest = manifest.Manifest.load(os.path.join(args.output, MANIFEST_FILENAME))
 
-            im: Image.Image = Image.open(image_path)
+    if args.prune:
+        manifest_keys = (os.path.relpath(image_path, args.input) for image_path in valid_files)
+        for removed_output in card_manifest.prune(manifest_keys):
+            this_logger.warning(f"--- Pruned {removed_output} because its input no longer exists ---")
 
-            card_is_creature = True
-            if cockatrice_database is not None:
-                card = cockatrice_database.card_data.get(card_name)
-                if card is not None:
-                    card_is_creature = card.type.lower() == "creature" or card.type.lower() == "planeswalker"
+    imposer = None
+    if args.sheets:
+        imposer = image_utils.SheetImposer(args.sheets, tuple(args.sheet_size), tuple(args.sheet_card_size),
+                                           margin=args.sheet_margin, spacing=args.sheet_spacing,
+                                           save_options=dict(save_options(args)))
+        this_logger.warning(f"Laying out {imposer.columns}x{imposer.rows} cards per print sheet in {args.sheets}")
 
-            if args.scrub_artist:
-                image_utils.scrub(im, ((x, y) for x in ARTIST_X_RANGE_POST_MPC_READY for y in ARTIST_Y_RANGE_POST_MPC_READY))
-
-            if args.scrub_copyright:
-                if card_is_creature:
-                    this_logger.info(f"--- Inputted file is a creature or planeswalker, "
-                                     f"using a different range for removing "
-                                     f"copyright ---")
-                    image_utils.scrub(im, ((x, y) for x in COPYRIGHT_X_RANGE for y in COPYRIGHT_Y_RANGE_CREATURE))
-                else:
-                    this_logger.info(f"--- Inputted file is non-creature, using standard range for removing "
-                                     f"copyright ---")
-                    image_utils.scrub(im, ((x, y) for x in COPYRIGHT_X_RANGE for y in COPYRIGHT_Y_RANGE_NONCREATURE))
+    profile = {"cards": [], "wall_seconds": 0.0} if args.profile_report else None
 
-            if args.scrub_corners:
-                for x_range, y_range in CORNER_RANGES:
-                    image_utils.scrub(im,
-                                      ((x, y) for x in x_range for y in y_range),
-                                      scrub_color=tuple(args.corner_scrub_color))
+    try:
+        process_files(valid_files, args, cockatrice_database, card_manifest, imposer, profile)
 
-            if args.scrub_not_for_sale:
-                image_utils.scrub(im, ((x, y) for x in NOT_FOR_SALE_X_RANGE for y in NOT_FOR_SALE_Y_RANGE))
-
-            #im = image_utils.resize_canvas(im, *MPC_ADJUSTED_DIMENSIONS, new_background=(0, 0, 0) if len(im.mode) == 3 else (0, 0, 0, 255))
-            im.save(os.path.join(args.output, os.path.basename(im_filename)) + ".png")
-            im.close()
-
-        except Exception as e:
-            if args.raise_errors:
-                raise e
-            this_logger.error(f"An error occurred! {e}")
+        if args.watch:
+            watch(args, cockatrice_database, card_manifest, imposer, profile)
+    finally:
+        if imposer is not None:
+            sheet_path = imposer.flush()
+            if sheet_path is not None:
+                this_logger.warning(f"--- Saved print sheet {sheet_path} ---")
+        if profile is not None:
+            write_profile_report(profile, args.profile_report)
 
 if __name__ == "__main__":
     main()
-
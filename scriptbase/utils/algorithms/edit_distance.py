@@ -13,37 +13,61 @@ def numeric_edit_distance(a: str, b: str) -> int:
         int: Levenshtein distance between a and b
     """
 
-    dynamic_values = {}
+    # Only the previous row of the dynamic programming table is needed at any time, so
+    # the table is built up a row at a time: previous_row[j] is the distance between the
+    # first i - 1 characters of a and the first j characters of b
+    if len(a) < len(b):
+        a, b = b, a
 
-    def numeric_edit_distance_dynamic(x: str, y: str):
-        """
-        Helper function that allows for the dynamic programming implementation
-        of the Levenshtein distance
-        """
+    previous_row = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current_row = [i]
+        for j, b_char in enumerate(b, 1):
+            current_row.append(min(previous_row[j] + 1,
+                                   current_row[j - 1] + 1,
+                                   previous_row[j - 1] + (a_char != b_char)))
+        previous_row = current_row
 
-        if (x, y) in dynamic_values:
-            return dynamic_values[(x, y)]
+    return previous_row[-1]
 
-        if not x:
-            return len(y)
-        if not y:
-            return len(x)
 
-        if x[0] == y[0]:
-            dynamic_values[(x, y)] = numeric_edit_distance_dynamic(x[1:], y[1:])
-            return dynamic_values[(x, y)]
+def substring_edit_distance(text: str, pattern: str) -> Tuple[int, int, int]:
+    """
+    Finds the sub-string of text with the smallest Levenshtein distance to pattern (Sellers' algorithm)
 
-        val1 = numeric_edit_distance_dynamic(x, y[1:])
-        val2 = numeric_edit_distance_dynamic(x[1:], y)
-        val3 = numeric_edit_distance_dynamic(x[1:], y[1:])
+    This is a single O(len(text) * len(pattern)) dynamic programming pass: the same table as
+    numeric_edit_distance, except that skipping characters at the start or end of text is free.
+    Ties are broken in favour of the shortest sub-string, then the leftmost.
 
-        dynamic_values[(x, y)] = 1 + min(val1, val2, val3)
-        return dynamic_values[(x, y)]
+    Parameters:
+        text (str): String to search in
+        pattern (str): String to search for
 
-    for str_len in range(1, max(len(a), len(b))):
-        numeric_edit_distance_dynamic(a[0:str_len], b[0:str_len])
+    Returns:
+        Tuple[int, int, int]: Distance, and the start and end of the sub-string, so it is text[start:end]
+    """
 
-    return numeric_edit_distance_dynamic(a, b)
+    # previous_row[j] is the smallest distance between the first i - 1 characters of pattern and a
+    # sub-string of text ending at j, and previous_starts[j] is where that sub-string starts.
+    # Any sub-string may be the start of a match, so the first row is all zeros
+    previous_row = [0] * (len(text) + 1)
+    previous_starts = list(range(len(text) + 1))
+    for i, pattern_char in enumerate(pattern, 1):
+        current_row = [i]
+        current_starts = [0]
+        for j, text_char in enumerate(text, 1):
+            # (distance, -start) so that ties go to the latest start, i.e. the shortest sub-string
+            current_row_value, negative_start = min(
+                (previous_row[j - 1] + (pattern_char != text_char), -previous_starts[j - 1]),
+                (previous_row[j] + 1, -previous_starts[j]),
+                (current_row[j - 1] + 1, -current_starts[j - 1]))
+            current_row.append(current_row_value)
+            current_starts.append(-negative_start)
+        previous_row, previous_starts = current_row, current_starts
+
+    # Any end is free too, so the match ends wherever the last row is smallest
+    distance, length, end = min((previous_row[j], j - previous_starts[j], j) for j in range(len(text) + 1))
+    return distance, end - length, end
 
 
 def describe_edit_distance(a: str, b: str) -> Tuple[int, tuple]:
@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, List, Tuple
+
+
+class EditDistanceTrie:
+    """
+    Trie of words that can find every word within a given edit distance of some sub-string of a text.
+
+    The search walks the trie once, carrying the column of a semi-global edit distance table: entry j
+    is the smallest distance between the current trie prefix and any sub-string of the text ending at
+    position j (starting anywhere, so the first column is all zeros). The smallest entry in a column
+    never decreases further down the trie, so any branch whose column minimum is above max_distance
+    is skipped. Shallow prefixes are short enough to match almost anywhere, but branches are cut
+    quickly after a few characters, so a search visits a small part of a large trie.
+
+    Nodes are stored as [{character: child}, word or None] lists so that the trie pickles compactly.
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        """
+        Parameters:
+            words (Iterable[str]): Words to add. Duplicates are only stored once
+        """
+
+        self.root = [{}, None]
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, word: str) -> bool:
+        """
+        Adds a word to the trie
+
+        Parameters:
+            word (str): Word to add
+
+        Returns:
+            bool: False if the word was already in the trie
+        """
+
+        node = self.root
+        for character in word:
+            node = node[0].setdefault(character, [{}, None])
+        if node[1] is not None:
+            return False
+        node[1] = word
+        self.size += 1
+        return True
+
+    def search_substrings(self, text: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Finds every word within max_distance edits of some sub-string of text
+
+        Parameters:
+            text (str): Text to search in
+            max_distance (int): Largest edit distance to return
+
+        Returns:
+            List[Tuple[int, str]]: (smallest distance to a sub-string of text, word) pairs, in no particular order
+        """
+
+        matches = []
+        nodes_to_visit: List[Tuple[Dict, List[int]]] = [(self.root[0], [0] * (len(text) + 1))]
+        while nodes_to_visit:
+            children, column = nodes_to_visit.pop()
+            for character, (grandchildren, word) in children.items():
+                next_column = [column[0] + 1]
+                for j, text_character in enumerate(text, 1):
+                    next_column.append(min(column[j] + 1,
+                                           next_column[j - 1] + 1,
+                                           column[j - 1] + (text_character != character)))
+
+                best_distance = min(next_column)
+                if best_distance > max_distance:
+                    continue
+                if word is not None:
+                    matches.append((best_distance, word))
+                if grandchildren:
+                    nodes_to_visit.append((grandchildren, next_column))
+
+        return matches
@@ -0,0 +1,104 @@
+import collections
+
+from typing import Dict, Iterable, List, Tuple
+
+
+def qgrams(text: str, q: int) -> collections.Counter:
+    """
+    Counts the (unpadded) sub-strings of length q of text
+
+    Parameters:
+        text (str): Text to split into q-grams
+        q (int): Length of each q-gram
+
+    Returns:
+        collections.Counter: Number of times each q-gram occurs
+    """
+
+    return collections.Counter(text[i:i + q] for i in range(len(text) - q + 1))
+
+
+class QGramIndex:
+    """
+    Inverted index from q-grams to the words containing them, used to rule words out before
+    computing any edit distance.
+
+    Count filter: a word w has len(w) - q + 1 q-grams, and one edit can destroy at most q of them,
+    so if w is within k edits of some sub-string of a text, at least len(w) - q + 1 - k * q of w's
+    q-grams also occur in the text. Words sharing fewer are skipped. Words too short for the bound
+    to be positive can't be ruled out this way and always pass.
+    """
+
+    def __init__(self, words: Iterable[str] = (), q: int = 2):
+        """
+        Parameters:
+            words (Iterable[str]): Words to add. Duplicates are only stored once
+            q (int): Length of the q-grams to index
+        """
+
+        self.q = q
+        self.words: List[str] = []
+        self.word_ids: Dict[str, int] = {}
+        # q-gram -> list of (word id, number of times the q-gram occurs in that word)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.word_ids_by_length: Dict[int, List[int]] = {}
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def add(self, word: str) -> bool:
+        """
+        Adds a word to the index
+
+        Parameters:
+            word (str): Word to add
+
+        Returns:
+            bool: False if the word was already in the index
+        """
+
+        if word in self.word_ids:
+            return False
+        word_id = self.word_ids[word] = len(self.words)
+        self.words.append(word)
+        self.word_ids_by_length.setdefault(len(word), []).append(word_id)
+        for gram, count in qgrams(word, self.q).items():
+            self.postings.setdefault(gram, []).append((word_id, count))
+        return True
+
+    def required_shared(self, word_length: int, max_distance: int) -> int:
+        """
+        Returns how many q-grams a word of the given length must share with a text to be within
+        max_distance edits of one of its sub-strings
+        """
+
+        return word_length - self.q + 1 - max_distance * self.q
+
+    def count_filter(self, text: str, max_distance: int) -> List[str]:
+        """
+        Finds the words that pass the count filter for text, i.e. every word that may be within
+        max_distance edits of a sub-string of text
+
+        Parameters:
+            text (str): Text to search in
+            max_distance (int): Largest edit distance to allow
+
+        Returns:
+            List[str]: Words passing the filter, in the order they were added
+        """
+
+        shared = collections.Counter()
+        for gram, text_count in qgrams(text, self.q).items():
+            for word_id, word_count in self.postings.get(gram, ()):
+                shared[word_id] += min(text_count, word_count)
+
+        # Only words sharing at least one q-gram need checking, plus the short words that always pass
+        passing_ids = [word_id for word_id, count in shared.items()
+                       if count >= self.required_shared(len(self.words[word_id]), max_distance)]
+        for length, word_ids in self.word_ids_by_length.items():
+            if self.required_shared(length, max_distance) <= 0:
+                passing_ids.extend(word_id for word_id in word_ids if word_id not in shared)
+
+        return [self.words[word_id] for word_id in sorted(passing_ids)]
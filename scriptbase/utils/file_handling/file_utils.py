@@ -1,5 +1,7 @@
 import csv
+import hashlib
 import os
+import shutil
 
 from typing import List
 
@@ -44,3 +46,63 @@ def get_csv_contents(csv_path: str) -> List[List]:
         csv_file = csv.reader(F)
 
         return [line for line in csv_file]
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20, algorithm: str = "sha256") -> str:
+    """
+    Computes the digest of a file, reading it in chunks so large files
+    are never held in memory all at once
+
+    Parameters:
+        file_path (str): Path to the file to hash
+        chunk_size (int): Number of bytes to read at a time
+        algorithm (str): Name of the hashlib algorithm to use. Defaults to SHA-256
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as F:
+        for chunk in iter(lambda: F.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def link_or_copy(source_path: str, destination_path: str):
+    """
+    Makes destination_path a hard link to source_path, falling back to copying the file
+    if hard links aren't possible (e.g. across file systems). Any existing file at
+    destination_path is replaced.
+
+    Parameters:
+        source_path (str): Existing file
+        destination_path (str): Path to link or copy it to
+    """
+
+    if os.path.abspath(source_path) == os.path.abspath(destination_path):
+        return
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+
+
+def break_hard_link(file_path: str):
+    """
+    Removes file_path if it shares its contents with other hard links, so that writing
+    a new file at file_path doesn't also change the other links
+
+    Parameters:
+        file_path (str): Path about to be written to
+    """
+
+    try:
+        if os.stat(file_path).st_nlink > 1:
+            os.remove(file_path)
+    except FileNotFoundError:
+        pass
@@ -1,5 +1,17 @@
+import functools
+import os
+import threading
+
 from PIL import Image
-from typing import List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
+
+import scriptbase.utils.profiling.stage_timing as stage_timing
+
+Rect = Tuple[int, int, int, int]
+ScrubRegion = Tuple[Rect, tuple]
+## A scrub region with a name to label it by, e.g. in stage timings
+NamedScrubRegion = Tuple[Rect, tuple, str]
+
 
 def scrub(image: Image.Image, coords, scrub_color: tuple = (0, 0, 0)) -> Image.Image:
     """
@@ -20,6 +32,145 @@ def scrub(image: Image.Image, coords, scrub_color: tuple = (0, 0, 0)) -> Image.I
     return image
 
 
+def fill_color(image: Image.Image, color: tuple):
+    """
+    Converts a color tuple into a value Image.paste accepts for the mode of image.
+    Palette images need an index into their palette rather than an RGB tuple.
+
+    Parameters:
+        image (Image.Image): Image the color will be used on
+        color (tuple): Color as a tuple
+
+    Returns:
+        Union[int, tuple]: Color to fill with
+    """
+
+    if image.mode == "P" and isinstance(color, tuple) and len(color) in (3, 4):
+        return image.palette.getcolor(color, image)
+    return color
+
+
+def scrub_rects(image: Image.Image, rects: Iterable[Rect], scrub_color: tuple = (0, 0, 0)) -> Image.Image:
+    """
+    Fills each rectangle with scrub_color. Each rectangle is filled in one call rather than
+    pixel by pixel, so this is much faster than scrub for large regions.
+
+    Rectangles are (x0, y0, x1, y1) with the end coordinates exclusive, i.e. the same
+    area as scrub over range(x0, x1) x range(y0, y1). Parts of a rectangle outside the
+    image are ignored.
+
+    Parameters:
+          image (Image.Image): Image object to use
+          rects (Iterable[Rect]): Rectangles to fill
+          scrub_color (tuple): Color to scrub the pixels with
+
+    Returns:
+          image (Image.Image): Inputted image, scrubbed
+    """
+
+    color = fill_color(image, scrub_color)
+    for rect in rects:
+        image.paste(color, rect)
+
+    return image
+
+
+@functools.lru_cache(maxsize=64)
+def scrub_template_plan(regions: Tuple[ScrubRegion, ...],
+                        size: Tuple[int, int],
+                        mode: str) -> Tuple[Tuple[Rect, tuple], ...]:
+    """
+    Precomputes how to scrub a fixed set of regions on images of a given size and mode:
+    regions are clipped to the image, regions entirely painted over by a later region
+    are dropped, and each color is resolved to a pixel value of the image mode.
+
+    The result is cached, so images that share a layout, size and mode only work it out once.
+
+    Parameters:
+        regions (Tuple[ScrubRegion, ...]): Tuple of (rect, color) pairs; later regions are painted over earlier ones
+        size (Tuple[int, int]): Size of the images the plan will be applied to
+        mode (str): Mode of the images the plan will be applied to
+
+    Returns:
+        Tuple[Tuple[Rect, tuple], ...]: (rect, pixel value) pairs to paste in order
+    """
+
+    def covers(outer: Rect, inner: Rect) -> bool:
+        return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+    clipped_regions = []
+    for (x0, y0, x1, y1), color in regions:
+        rect = (max(x0, 0), max(y0, 0), min(x1, size[0]), min(y1, size[1]))
+        if rect[0] < rect[2] and rect[1] < rect[3]:
+            clipped_regions.append((rect, color))
+
+    # A 1x1 swatch both validates the color against the mode and gives its exact pixel value
+    swatch = Image.new(mode, (1, 1))
+    plan = []
+    for i, (rect, color) in enumerate(clipped_regions):
+        if any(covers(later_rect, rect) for later_rect, _ in clipped_regions[i + 1:]):
+            continue
+        swatch.paste(color, (0, 0, 1, 1))
+        pixel_value = swatch.getpixel((0, 0))
+        plan.append((rect, pixel_value if isinstance(pixel_value, tuple) else (pixel_value,)))
+
+    return tuple(plan)
+
+
+def scrub_template(image: Image.Image, regions: Iterable[ScrubRegion]) -> Image.Image:
+    """
+    Scrubs every region using a cached plan for the combination of regions, image
+    size and image mode (see scrub_template_plan).
+
+    Palette images are scrubbed without a plan, since the fill color depends on
+    each image's palette.
+
+    Parameters:
+        image (Image.Image): Image object to use
+        regions (Iterable[ScrubRegion]): (rect, color) pairs to scrub, see scrub_rects for the rect format
+
+    Returns:
+        image (Image.Image): Inputted image, scrubbed
+    """
+
+    regions = tuple((tuple(rect), tuple(color)) for rect, color in regions)
+
+    if image.mode == "P":
+        for rect, color in regions:
+            scrub_rects(image, [rect], scrub_color=color)
+        return image
+
+    for rect, pixel_value in scrub_template_plan(regions, image.size, image.mode):
+        image.paste(pixel_value, rect)
+
+    return image
+
+
+def canvas_background(mode: str, new_background: tuple = None) -> tuple:
+    """
+    Returns the background color to use for a new canvas of the given mode, defaulting to white
+
+    Parameters:
+        mode (str): Mode of the canvas
+        new_background (tuple): Requested background color, if any
+
+    Returns:
+        tuple: Background color to use
+    """
+
+    if new_background is None:
+        if len(mode) == 1:
+            new_background = (255,)
+        if len(mode) == 3:
+            new_background = (255, 255, 255)
+        if len(mode) == 4:
+            new_background = (255, 255, 255, 255)
+    elif len(new_background) != len(mode):
+        raise ValueError(f"Input background color is of length {len(new_background)}, but image mode is {len(mode)}!")
+
+    return new_background
+
+
 def resize_canvas(image: Image.Image, new_x: int, new_y: int, new_background: tuple = None) -> Image.Image:
     """
     Resizes the canvas of the image, centering the image on the new canvas.
@@ -38,17 +189,403 @@ def resize_canvas(image: Image.Image, new_x: int, new_y: int, new_background: tu
     y_offset = (new_y - image.size[1]) // 2
 
     mode = image.mode
-    if new_background is None:
-        if len(mode) == 1:
-            new_background = (255,)
-        if len(mode) == 3:
-            new_background = (255, 255, 255)
-        if len(mode) == 4:
-            new_background = (255, 255, 255, 255)
-    elif len(new_background) != len(mode):
-        raise ValueError(f"Input background color is of length {len(new_background)}, but image mode is {len(mode)}!")
+    new_background = canvas_background(mode, new_background)
 
     return_image = Image.new(mode, (new_x, new_y), new_background)
     return_image.paste(image, (x_offset, y_offset, x_offset + image.size[0], y_offset + image.size[1]))
 
     return return_image
+
+
+BLEED_METHODS = ("replicate", "mirror")
+
+
+def fill_bleed(canvas: Image.Image, source_rect: Rect, method: str = "replicate") -> Image.Image:
+    """
+    Fills the area of canvas around source_rect by extending the pixels at the edge of source_rect
+    outwards, so the image bleeds past its original borders rather than sitting on a flat background.
+
+    Each side is filled with a single paste of a strip: "replicate" stretches the outermost row or
+    column of pixels, "mirror" reflects the pixels next to the edge (including the edge itself).
+    The left and right sides are filled first, so the top and bottom strips also fill the corners.
+
+    Parameters:
+        canvas (Image.Image): Canvas holding the image within source_rect, modified in place
+        source_rect (Rect): Area of canvas occupied by the image, see scrub_rects for the format
+        method (str): One of BLEED_METHODS
+
+    Returns:
+        Image.Image: canvas, with the bleed filled
+    """
+
+    if method not in BLEED_METHODS:
+        raise ValueError(f"Unknown bleed method {method}, expected one of {BLEED_METHODS}!")
+
+    x0, y0, x1, y1 = source_rect
+    width, height = canvas.size
+    left, right, top, bottom = x0, width - x1, y0, height - y1
+    if min(left, right, top, bottom) < 0:
+        raise ValueError(f"Image area {source_rect} does not fit on a canvas of size {canvas.size}!")
+
+    if method == "replicate":
+        strips = [((x0, y0, x0 + 1, y1), (left, y1 - y0), (0, y0)),
+                  ((x1 - 1, y0, x1, y1), (right, y1 - y0), (x1, y0)),
+                  ((0, y0, width, y0 + 1), (width, top), (0, 0)),
+                  ((0, y1 - 1, width, y1), (width, bottom), (0, y1))]
+        for crop_rect, strip_size, position in strips:
+            if strip_size[0] and strip_size[1]:
+                canvas.paste(canvas.crop(crop_rect).resize(strip_size, Image.NEAREST), position)
+    else:
+        if max(left, right) > x1 - x0 or max(top, bottom) > y1 - y0:
+            raise ValueError(f"Bleed is wider than the image, so it cannot be mirrored!")
+        strips = [((x0, y0, x0 + left, y1), Image.FLIP_LEFT_RIGHT, (0, y0)),
+                  ((x1 - right, y0, x1, y1), Image.FLIP_LEFT_RIGHT, (x1, y0)),
+                  ((0, y0, width, y0 + top), Image.FLIP_TOP_BOTTOM, (0, 0)),
+                  ((0, y1 - bottom, width, y1), Image.FLIP_TOP_BOTTOM, (0, y1))]
+        for crop_rect, flip, position in strips:
+            if crop_rect[0] < crop_rect[2] and crop_rect[1] < crop_rect[3]:
+                canvas.paste(canvas.crop(crop_rect).transpose(flip), position)
+
+    return canvas
+
+
+def extend_bleed(image: Image.Image, new_x: int, new_y: int, method: str = "replicate") -> Image.Image:
+    """
+    Resizes the canvas of the image, centering the image on the new canvas and filling the
+    border by extending the image's own edge pixels (see fill_bleed).
+
+    Parameters:
+         image (Image.Image): Image object to extend
+         new_x (int): X size of new canvas, at least as large as the image
+         new_y (int): Y size of new canvas, at least as large as the image
+         method (str): One of BLEED_METHODS
+
+    Returns:
+        Image.Image: Extended version of input image
+    """
+
+    x_offset = (new_x - image.size[0]) // 2
+    y_offset = (new_y - image.size[1]) // 2
+
+    return_image = Image.new(image.mode, (new_x, new_y))
+    if image.mode == "P":
+        return_image.putpalette(image.getpalette())
+    return_image.paste(image, (x_offset, y_offset))
+
+    return fill_bleed(return_image, (x_offset, y_offset, x_offset + image.size[0], y_offset + image.size[1]), method)
+
+
+class ImagePipeline:
+    """
+    Records a sequence of operations (scrubs, a canvas resize, a mode conversion and save options)
+    and applies them to an image in one pass.
+
+    Rather than making a new image per operation, the source is pasted once into an output
+    buffer that is allocated once per thread and reused for every image of the same size and
+    mode, and all scrubs and background fills are then painted straight into that buffer. If
+    there is no canvas resize or mode conversion, the source image is scrubbed in place and no
+    buffer is used at all.
+
+    With extend_bleed instead of resize_canvas, the border is filled from the image's own edge
+    pixels after the pre-canvas scrubs, so e.g. scrubbed corners are what bleeds outwards.
+
+    A pipeline can be reused for a whole batch of images, e.g.:
+        pipeline = ImagePipeline().scrub(regions).resize_canvas(816, 1110).save_options(compress_level=1)
+        for path in paths:
+            with Image.open(path) as im:
+                pipeline.save(im, output_path)
+    """
+
+    def __init__(self):
+        self._regions_before_canvas: List[NamedScrubRegion] = []
+        self._regions_after_canvas: List[NamedScrubRegion] = []
+        self._canvas: Optional[Tuple[int, int, Optional[tuple]]] = None
+        self._bleed_method: Optional[str] = None
+        self._mode: Optional[str] = None
+        self._save_options: dict = {}
+        self._local = threading.local()
+
+    def scrub(self, regions: Iterable[tuple]) -> 'ImagePipeline':
+        """
+        Records regions to scrub, as (rect, color) pairs (see scrub_template) or (rect, color, name)
+        triples. The name labels the region's timing when profiling (see run), and defaults to the
+        rect. Regions recorded before resize_canvas are in the coordinates of the source image and
+        never spill onto the new background; regions recorded after it are in the coordinates of
+        the new canvas. Colors are always given in the output mode.
+
+        Returns:
+            ImagePipeline: This pipeline, so calls can be chained
+        """
+
+        regions = [(tuple(region[0]), tuple(region[1]), region[2] if len(region) > 2 else str(tuple(region[0])))
+                   for region in regions]
+        if self._canvas is None:
+            self._regions_before_canvas += regions
+        else:
+            self._regions_after_canvas += regions
+        return self
+
+    def resize_canvas(self, new_x: int, new_y: int, new_background: tuple = None) -> 'ImagePipeline':
+        """
+        Records a canvas resize, centering the image on a new_x by new_y canvas of new_background
+        (see resize_canvas). Only one canvas resize can be recorded.
+
+        Returns:
+            ImagePipeline: This pipeline, so calls can be chained
+        """
+
+        if self._canvas is not None:
+            raise ValueError("An ImagePipeline can only resize the canvas once!")
+        self._canvas = (new_x, new_y, tuple(new_background) if new_background is not None else None)
+        return self
+
+    def extend_bleed(self, new_x: int, new_y: int, method: str = "replicate") -> 'ImagePipeline':
+        """
+        Records a canvas resize whose border is filled by extending the image's edge pixels
+        (see extend_bleed). This counts as the pipeline's one canvas resize.
+
+        Returns:
+            ImagePipeline: This pipeline, so calls can be chained
+        """
+
+        if method not in BLEED_METHODS:
+            raise ValueError(f"Unknown bleed method {method}, expected one of {BLEED_METHODS}!")
+        self.resize_canvas(new_x, new_y)
+        self._bleed_method = method
+        return self
+
+    def convert(self, mode: str) -> 'ImagePipeline':
+        """
+        Records a conversion of the output to the given mode
+
+        Returns:
+            ImagePipeline: This pipeline, so calls can be chained
+        """
+
+        self._mode = mode
+        return self
+
+    def save_options(self, **options) -> 'ImagePipeline':
+        """
+        Records keyword arguments to pass to Image.save, e.g. compress_level or optimize
+
+        Returns:
+            ImagePipeline: This pipeline, so calls can be chained
+        """
+
+        self._save_options.update(options)
+        return self
+
+    def _buffer(self, mode: str, size: Tuple[int, int], reuse_buffer: bool = True) -> Image.Image:
+        if not reuse_buffer:
+            return Image.new(mode, size)
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.mode != mode or buffer.size != size:
+            buffer = Image.new(mode, size)
+            self._local.buffer = buffer
+        return buffer
+
+    def _scrub(self, output: Image.Image, regions: List[NamedScrubRegion], timings: Optional[Dict[str, float]]):
+        if timings is None:
+            scrub_template(output, [(rect, color) for rect, color, _ in regions])
+            return
+        # When profiling, time each region on its own
+        for rect, color, name in regions:
+            with stage_timing.timed(timings, f"scrub {name}"):
+                scrub_template(output, [(rect, color)])
+
+    def run(self, image: Image.Image, reuse_buffer: bool = True,
+            timings: Optional[Dict[str, float]] = None) -> Image.Image:
+        """
+        Applies the recorded operations to image.
+
+        The returned image may be image itself (scrubbed in place) or the pipeline's output
+        buffer, which is overwritten by the next call to run on the same thread - copy it if it
+        needs to outlive that, or pass reuse_buffer=False to get a freshly allocated output.
+
+        Parameters:
+            image (Image.Image): Image to process
+            reuse_buffer (bool): Whether to reuse this thread's output buffer
+            timings (Optional[Dict[str, float]]): If given, the time spent in each step is added to it
+                                                  (see stage_timing.timed), with each scrub region timed separately
+                                                  under its name
+
+        Returns:
+            Image.Image: Processed image
+        """
+
+        mode = self._mode if self._mode is not None else image.mode
+        width, height = image.size
+
+        if self._canvas is None:
+            with stage_timing.timed(timings, "paste"):
+                if mode == image.mode:
+                    output = image
+                    output.load()
+                else:
+                    output = self._buffer(mode, image.size, reuse_buffer)
+                    output.paste(image, (0, 0))
+            self._scrub(output, self._regions_before_canvas + self._regions_after_canvas, timings)
+            return output
+
+        new_x, new_y, new_background = self._canvas
+        x_offset = (new_x - width) // 2
+        y_offset = (new_y - height) // 2
+        source_rect = (x_offset, y_offset, x_offset + width, y_offset + height)
+
+        with stage_timing.timed(timings, "paste"):
+            output = self._buffer(mode, (new_x, new_y), reuse_buffer)
+            if mode == "P" and image.mode == "P":
+                output.putpalette(image.getpalette())
+            output.paste(image, (x_offset, y_offset))
+
+        shifted_regions = []
+        for (x0, y0, x1, y1), color, name in self._regions_before_canvas:
+            rect = (max(x0, 0) + x_offset, max(y0, 0) + y_offset,
+                    min(x1, width) + x_offset, min(y1, height) + y_offset)
+            shifted_regions.append((rect, color, name))
+        self._scrub(output, shifted_regions, timings)
+
+        with stage_timing.timed(timings, "canvas"):
+            if self._bleed_method is not None:
+                fill_bleed(output, source_rect, self._bleed_method)
+            else:
+                # Only the strips around the source need the background - the rest was pasted over
+                background = canvas_background(mode, new_background)
+                border = [(0, 0, new_x, y_offset), (0, y_offset + height, new_x, new_y),
+                          (0, y_offset, x_offset, y_offset + height),
+                          (x_offset + width, y_offset, new_x, y_offset + height)]
+                scrub_template(output, [(rect, background) for rect in border])
+
+        self._scrub(output, self._regions_after_canvas, timings)
+
+        return output
+
+    def save(self, image: Image.Image, path: str, **options) -> Image.Image:
+        """
+        Runs the pipeline on image and saves the result to path with the recorded save options
+
+        Parameters:
+            image (Image.Image): Image to process
+            path (str): Path to save the result to
+            options: Extra keyword arguments for Image.save, overriding the recorded ones
+
+        Returns:
+            Image.Image: Processed image, see run
+        """
+
+        output = self.run(image)
+        output.save(path, **{**self._save_options, **options})
+        return output
+
+
+class SheetImposer:
+    """
+    Lays images out in a grid on fixed-size print sheets, saving each sheet as soon as it is full.
+
+    Only one sheet canvas is ever allocated: each image is pasted straight into its slot, and once
+    a sheet is saved the next one simply pastes over the same slots, so a whole set never has to
+    be held in memory. Use as a context manager (or call flush) so the last, partial sheet is saved.
+    """
+
+    def __init__(self,
+                 output_folder: str,
+                 sheet_size: Tuple[int, int],
+                 card_size: Tuple[int, int],
+                 margin: int = 0,
+                 spacing: int = 0,
+                 background: tuple = (255, 255, 255),
+                 mode: str = "RGB",
+                 file_pattern: str = "sheet_{:04}.png",
+                 save_options: Optional[dict] = None):
+        """
+        Parameters:
+            output_folder (str): Folder to save the sheets in
+            sheet_size (Tuple[int, int]): Size of a sheet in pixels
+            card_size (Tuple[int, int]): Size of a slot in pixels; images of another size are resized to fit
+            margin (int): Blank border around the grid, in pixels
+            spacing (int): Gap between neighbouring slots (for cutting), in pixels
+            background (tuple): Color of the sheet behind the images
+            mode (str): Mode of the sheets
+            file_pattern (str): Format string for sheet file names, given the sheet number
+            save_options (Optional[dict]): Keyword arguments to pass to Image.save
+        """
+
+        self.output_folder = output_folder
+        self.card_size = card_size
+        self.margin = margin
+        self.spacing = spacing
+        self.background = canvas_background(mode, background)
+        self.file_pattern = file_pattern
+        self.save_options = save_options or {}
+
+        self.columns = (sheet_size[0] - 2 * margin + spacing) // (card_size[0] + spacing)
+        self.rows = (sheet_size[1] - 2 * margin + spacing) // (card_size[1] + spacing)
+        if self.columns < 1 or self.rows < 1:
+            raise ValueError(f"A {card_size} card does not fit on a {sheet_size} sheet with a margin of {margin}!")
+
+        self.canvas = Image.new(mode, sheet_size, self.background)
+        self.sheets_saved = 0
+        self._filled_slots = 0
+
+    @property
+    def slots_per_sheet(self) -> int:
+        return self.columns * self.rows
+
+    def slot_rect(self, slot: int) -> Rect:
+        """
+        Returns the area of the sheet occupied by the slot with the given index, filling rows first
+        """
+
+        row, column = divmod(slot, self.columns)
+        x0 = self.margin + column * (self.card_size[0] + self.spacing)
+        y0 = self.margin + row * (self.card_size[1] + self.spacing)
+        return x0, y0, x0 + self.card_size[0], y0 + self.card_size[1]
+
+    def add(self, image: Image.Image) -> Optional[str]:
+        """
+        Pastes image into the next free slot, saving the sheet if that fills it
+
+        Parameters:
+            image (Image.Image): Image to add
+
+        Returns:
+            Optional[str]: Path of the sheet that was saved, if any
+        """
+
+        if image.size != self.card_size:
+            image = image.resize(self.card_size, Image.LANCZOS)
+        self.canvas.paste(image, self.slot_rect(self._filled_slots)[0:2])
+        self._filled_slots += 1
+
+        if self._filled_slots == self.slots_per_sheet:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """
+        Saves the current sheet if anything is on it, blanking out any unused slots first
+
+        Returns:
+            Optional[str]: Path of the sheet that was saved, if any
+        """
+
+        if not self._filled_slots:
+            return None
+
+        # Slots left over from the previous sheet would otherwise show through
+        unused_slots = range(self._filled_slots, self.slots_per_sheet)
+        scrub_template(self.canvas, [(self.slot_rect(slot), self.background) for slot in unused_slots])
+
+        self.sheets_saved += 1
+        sheet_path = os.path.join(self.output_folder, self.file_pattern.format(self.sheets_saved))
+        self.canvas.save(sheet_path, **self.save_options)
+        self._filled_slots = 0
+
+        return sheet_path
+
+    def __enter__(self) -> 'SheetImposer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
@@ -0,0 +1,193 @@
+import json
+import os
+
+from typing import Dict, List, Optional
+
+import scriptbase.utils.file_handling.file_utils as file_utils
+
+
+class Manifest:
+    """
+    Records which inputs have already been turned into outputs, so that a batch
+    job can skip any input whose contents and settings are unchanged since the last run.
+
+    Each entry is keyed by an identifier for the input (usually its path relative to the
+    input folder) and stores the input's size, mtime and content hash, the output it produced
+    and a digest of the settings used to produce it.
+
+    Outputs are stored relative to the folder containing the manifest, so the manifest stays
+    valid whatever the working directory of the run that reads it.
+    """
+
+    ## Version 1 stored outputs relative to the working directory of the run that recorded them
+    VERSION = 2
+
+    def __init__(self, path: str):
+        """
+        Parameters:
+            path (str): Location of the manifest file on disk
+        """
+
+        self.path = path
+        self.folder = os.path.dirname(os.path.abspath(path))
+        self.entries: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        """
+        Loads a manifest from disk, returning an empty manifest if the file does not
+        exist, is unreadable or was written by a different version
+
+        Parameters:
+            path (str): Location of the manifest file on disk
+
+        Returns:
+            Manifest: Loaded manifest
+        """
+
+        manifest = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as F:
+                data = json.load(F)
+        except (OSError, ValueError):
+            return manifest
+
+        if isinstance(data, dict) and data.get("version") == cls.VERSION:
+            manifest.entries = data.get("entries", {})
+
+        return manifest
+
+    def save(self):
+        """
+        Writes the manifest to disk. The file is replaced atomically so an interrupted
+        run never leaves a half-written manifest behind.
+        """
+
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as F:
+            json.dump({"version": self.VERSION, "entries": self.entries}, F, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    def output_path(self, key: str) -> str:
+        """
+        Returns the path of the output recorded for an input
+
+        Parameters:
+            key (str): Identifier of the input in the manifest
+
+        Returns:
+            str: Path to the output
+        """
+
+        return self._resolve(self.entries[key]["output"])
+
+    def _resolve(self, stored_output: str) -> str:
+        return os.path.normpath(os.path.join(self.folder, stored_output))
+
+    def _relative(self, output_path: str) -> str:
+        try:
+            return os.path.relpath(output_path, self.folder)
+        except ValueError:
+            # On Windows, paths on another drive have no relative form
+            return os.path.abspath(output_path)
+
+    def is_current(self, key: str, input_path: str, settings_digest: str) -> bool:
+        """
+        Checks whether the recorded output for an input is still up to date.
+
+        The size and mtime are compared first; the content hash is only computed if the
+        size matches but the mtime has moved (e.g. the file was touched or re-copied).
+
+        Parameters:
+            key (str): Identifier of the input in the manifest
+            input_path (str): Path to the input file
+            settings_digest (str): Digest of the settings the output would be produced with
+
+        Returns:
+            bool: True if the input can be skipped
+        """
+
+        entry = self.entries.get(key)
+        if entry is None or entry["settings"] != settings_digest:
+            return False
+        if not os.path.exists(self._resolve(entry["output"])):
+            return False
+
+        stat = os.stat(input_path)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime"]:
+            return True
+
+        if file_utils.file_digest(input_path) != entry["hash"]:
+            return False
+
+        # Same contents, new mtime - remember the new mtime so we don't rehash next time
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    @staticmethod
+    def input_state(input_path: str) -> dict:
+        """
+        Returns the size, mtime and content hash of an input, for record. Take it before the input is
+        processed, so that an input changed while it was being processed is not recorded as up to date.
+
+        Parameters:
+            input_path (str): Path to the input file
+
+        Returns:
+            dict: Size, mtime and hash of the input
+        """
+
+        # The mtime is read before hashing, so a change during hashing shows up as a moved mtime
+        stat = os.stat(input_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_utils.file_digest(input_path)}
+
+    def record(self, key: str, input_path: str, output_path: str, settings_digest: str,
+               input_state: Optional[dict] = None):
+        """
+        Records that input_path was processed into output_path with the given settings
+
+        Parameters:
+            key (str): Identifier of the input in the manifest
+            input_path (str): Path to the input file
+            output_path (str): Path to the output that was produced
+            settings_digest (str): Digest of the settings used
+            input_state (Optional[dict]): State of the input when it was processed (see input_state).
+                                          Taken now if not given
+        """
+
+        if input_state is None:
+            input_state = self.input_state(input_path)
+        self.entries[key] = {
+            "size": input_state["size"],
+            "mtime": input_state["mtime"],
+            "hash": input_state["hash"],
+            "output": self._relative(output_path),
+            "settings": settings_digest,
+        }
+
+    def prune(self, keys_to_keep, delete_outputs: bool = True) -> List[str]:
+        """
+        Drops every entry whose key is not in keys_to_keep, optionally deleting the outputs
+        that were produced from them
+
+        Parameters:
+            keys_to_keep (Iterable[str]): Keys of the inputs that still exist
+            delete_outputs (bool): Whether to delete the outputs of the dropped entries
+
+        Returns:
+            List[str]: Paths of the outputs belonging to the dropped entries
+        """
+
+        keys_to_keep = set(keys_to_keep)
+        still_referenced = {self._resolve(entry["output"]) for key, entry in self.entries.items() if key in keys_to_keep}
+
+        removed_outputs = []
+        for key in [key for key in self.entries if key not in keys_to_keep]:
+            output_path = self._resolve(self.entries.pop(key)["output"])
+            removed_outputs.append(output_path)
+            if delete_outputs and output_path not in still_referenced and os.path.exists(output_path):
+                os.remove(output_path)
+
+        return removed_outputs
@@ -0,0 +1,209 @@
+import os
+import time
+
+from typing import Dict, Iterator, List, Set, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class DirectoryWatcher:
+    """
+    Watches a folder tree for new or changed files with the given extensions.
+
+    Without inotify, each poll stats the known directories and lists the ones whose mtime has
+    moved, and stats the files already seen, since modifying a file in place does not touch the
+    directory mtime. An idle tree costs one stat per directory and per file, and a periodic full
+    rescan catches anything else. With inotify_simple installed, the kernel tells us which
+    directories and files changed instead.
+
+    A file is only reported once its size and mtime have stopped changing for settle_time
+    seconds, so partially written exports are not picked up.
+    """
+
+    def __init__(self,
+                 folder: str,
+                 file_extensions: List[str],
+                 poll_interval: float = 1.0,
+                 settle_time: float = 2.0,
+                 full_scan_interval: float = 60.0,
+                 use_inotify: bool = True):
+        """
+        Parameters:
+            folder (str): Folder to watch, including sub-folders
+            file_extensions (List[str]): File extensions to report
+            poll_interval (float): Seconds between polls
+            settle_time (float): Seconds a file must stay unchanged before it is reported
+            full_scan_interval (float): Seconds between full rescans of every directory
+            use_inotify (bool): Use inotify if inotify_simple is installed
+        """
+
+        self.folder = folder
+        self.file_extensions = file_extensions
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.full_scan_interval = full_scan_interval
+
+        self._directory_mtimes: Dict[str, int] = {}
+        self._file_states: Dict[str, Tuple[int, int]] = {}
+        # path -> ((size, mtime), time that state was first observed)
+        self._pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self._last_full_scan = time.monotonic()
+
+        self._inotify = None
+        self._watch_descriptors: Dict[int, str] = {}
+        self._dirty_directories: Set[str] = set()
+        if use_inotify and inotify_simple is not None:
+            self._inotify = inotify_simple.INotify()
+
+        # Everything present at start-up is treated as already seen
+        for file_path, state in self._scan_directory(folder, force=True):
+            self._file_states[file_path] = state
+
+    @property
+    def using_inotify(self) -> bool:
+        return self._inotify is not None
+
+    def _is_valid(self, file_name: str) -> bool:
+        return any(file_name.endswith(extension) for extension in self.file_extensions)
+
+    def _add_inotify_watch(self, directory: str):
+        if self._inotify is None or directory in self._watch_descriptors.values():
+            return
+        flags = inotify_simple.flags
+        descriptor = self._inotify.add_watch(directory, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+                                             | flags.MODIFY | flags.DELETE_SELF)
+        self._watch_descriptors[descriptor] = directory
+
+    def _scan_directory(self, directory: str, force: bool = False) -> Iterator[Tuple[str, Tuple[int, int]]]:
+        """
+        Lists directory if its mtime has changed (or force is set), recursing into any new
+        sub-directories, and yields (path, (size, mtime)) for each valid file found
+        """
+
+        try:
+            directory_mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self._directory_mtimes.pop(directory, None)
+            return
+
+        if not force and self._directory_mtimes.get(directory) == directory_mtime:
+            return
+        self._directory_mtimes[directory] = directory_mtime
+        self._add_inotify_watch(directory)
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if entry.path not in self._directory_mtimes or force:
+                            yield from self._scan_directory(entry.path, force=force)
+                    elif self._is_valid(entry.name):
+                        stat = entry.stat()
+                        yield entry.path, (stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    continue
+
+    def _stat_known_files(self) -> Iterator[Tuple[str, Tuple[int, int]]]:
+        """
+        Yields (path, (size, mtime)) for each file seen so far that still exists
+        """
+
+        for file_path in list(self._file_states):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            yield file_path, (stat.st_size, stat.st_mtime_ns)
+
+    def _changed_directories(self) -> List[str]:
+        if self._inotify is not None:
+            self._read_inotify_events(timeout=0)
+            dirty_directories = list(self._dirty_directories)
+            self._dirty_directories.clear()
+            return dirty_directories
+        return list(self._directory_mtimes)
+
+    def _read_inotify_events(self, timeout: float):
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            directory = self._watch_descriptors.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & inotify_simple.flags.DELETE_SELF:
+                self._watch_descriptors.pop(event.wd)
+                continue
+            self._dirty_directories.add(directory)
+            if event.name and self._is_valid(event.name):
+                # The directory mtime may not change for an in-place rewrite, so track the file directly
+                self._pending.setdefault(os.path.join(directory, event.name), ((-1, -1), time.monotonic()))
+
+    def poll(self) -> List[str]:
+        """
+        Checks the folder tree once
+
+        Returns:
+            List[str]: Sorted paths of files that are new or changed and have finished being written
+        """
+
+        now = time.monotonic()
+        full_scan = now - self._last_full_scan >= self.full_scan_interval
+        if full_scan:
+            self._last_full_scan = now
+            directories, force = [self.folder], True
+        else:
+            directories, force = self._changed_directories(), False
+
+        found_files = [found_file for directory in directories
+                       for found_file in self._scan_directory(directory, force=force)]
+        if not full_scan and self._inotify is None:
+            found_files.extend(self._stat_known_files())
+
+        for file_path, state in found_files:
+            if self._file_states.get(file_path) != state and file_path not in self._pending:
+                self._pending[file_path] = (state, now)
+
+        ready = []
+        for file_path, (previous_state, first_seen) in list(self._pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                del self._pending[file_path]
+                continue
+
+            state = (stat.st_size, stat.st_mtime_ns)
+            if state != previous_state:
+                self._pending[file_path] = (state, now)
+            elif now - first_seen >= self.settle_time:
+                del self._pending[file_path]
+                if self._file_states.get(file_path) != state:
+                    self._file_states[file_path] = state
+                    ready.append(file_path)
+
+        ready.sort()
+        return ready
+
+    def wait(self):
+        """
+        Blocks until the next poll is due. With inotify, this returns early if something changes.
+        """
+
+        if self._inotify is not None and not self._pending:
+            self._read_inotify_events(timeout=self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
+
+    def watch(self) -> Iterator[List[str]]:
+        """
+        Polls forever, yielding each non-empty batch of new or changed files
+
+        Yields:
+            List[str]: Sorted paths of files that are ready to be processed
+        """
+
+        while True:
+            ready = self.poll()
+            if ready:
+                yield ready
+            self.wait()
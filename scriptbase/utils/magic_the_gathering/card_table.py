@@ -0,0 +1,262 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import scriptbase.utils.magic_the_gathering.cockatrice as cockatrice
+
+
+COLOR_IDS = ("W", "U", "B", "R", "G", "M", "C", "K")
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("CardTable requires numpy (pip install numpy)")
+
+
+class Categories:
+    """
+    Stores a column of repetitive strings as small integer codes into a list of the distinct values
+    """
+
+    def __init__(self, values: Iterable[Optional[str]], dtype="uint16", known_values: Sequence[str] = ()):
+        """
+        Parameters:
+            values (Iterable[Optional[str]]): Column values
+            dtype (str): NumPy dtype of the codes
+            known_values (Sequence[str]): Values to give the first codes, in order
+        """
+
+        self.values: List[Optional[str]] = list(known_values)
+        self.value_codes: Dict[Optional[str], int] = {value: code for code, value in enumerate(self.values)}
+
+        codes = []
+        for value in values:
+            code = self.value_codes.get(value)
+            if code is None:
+                code = self.value_codes[value] = len(self.values)
+                self.values.append(value)
+            codes.append(code)
+        self.codes = numpy.array(codes, dtype=dtype)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        return self.values[self.codes[index]]
+
+    def mask(self, value: Optional[str]) -> 'numpy.ndarray':
+        """
+        Returns a boolean mask of the rows equal to value
+        """
+
+        code = self.value_codes.get(value)
+        if code is None:
+            return numpy.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+
+class StringPool:
+    """
+    Stores a column of strings as one concatenated string plus an array of offsets, rather than
+    as one Python object per row
+    """
+
+    def __init__(self, strings: Iterable[Optional[str]]):
+        strings = list(strings)
+        self.missing = numpy.array([s is None for s in strings], dtype=bool)
+        strings = ["" if s is None else s for s in strings]
+
+        self.offsets = numpy.zeros(len(strings) + 1, dtype="int64")
+        numpy.cumsum([len(s) for s in strings], out=self.offsets[1:])
+        self.text = "".join(strings)
+
+    def __len__(self) -> int:
+        return len(self.missing)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        if self.missing[index]:
+            return None
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def contains(self, substring: str) -> 'numpy.ndarray':
+        """
+        Returns a boolean mask of the rows containing substring. The pooled text is searched once,
+        and each match is mapped back to its row by binary search over the offsets.
+
+        Parameters:
+            substring (str): Text to look for
+
+        Returns:
+            numpy.ndarray: Boolean mask with one entry per row
+        """
+
+        match_ends = []
+        start = self.text.find(substring)
+        while start != -1:
+            match_ends.append((start, start + len(substring)))
+            start = self.text.find(substring, start + 1)
+
+        mask = numpy.zeros(len(self), dtype=bool)
+        if not match_ends:
+            return mask
+
+        match_ends = numpy.array(match_ends, dtype="int64")
+        rows = numpy.searchsorted(self.offsets, match_ends[:, 0], side="right") - 1
+        ## Matches spanning the boundary between two rows don't count
+        within_row = match_ends[:, 1] <= self.offsets[rows + 1]
+        mask[rows[within_row]] = True
+        return mask & ~self.missing
+
+
+class CardTable:
+    """
+    Read-only columnar copy of a list of cards, for memory-lean storage and vectorized filtering.
+
+    cmc, color id, multicolor id, type and function are NumPy arrays of small integer codes; names,
+    mana costs, card text and sub/supertypes live in string pools. Building a table from a
+    CockatriceDatabase's set_list does not track later changes to the cards (e.g. their function).
+
+    Example:
+        table = CardTable.from_cards(database.set_list)
+        rows = table.rows(color_id="U", type="Creature", cmc_range=(2, 4), subtype="Wizard")
+    """
+
+    def __init__(self,
+                 cmc: 'numpy.ndarray',
+                 color_ids: Categories,
+                 multicolor_ids: Categories,
+                 types: Categories,
+                 functions: Categories,
+                 colors: Categories,
+                 names: StringPool,
+                 manacosts: StringPool,
+                 card_texts: StringPool,
+                 supertypes: StringPool,
+                 subtypes: StringPool):
+        _require_numpy()
+        self.cmc = cmc
+        self.color_ids = color_ids
+        self.multicolor_ids = multicolor_ids
+        self.types = types
+        self.functions = functions
+        self.colors = colors
+        self.names = names
+        self.manacosts = manacosts
+        self.card_texts = card_texts
+        ## Sub/supertypes are pooled space-separated with a space either side, so " Wizard " only matches whole words
+        self.supertypes = supertypes
+        self.subtypes = subtypes
+
+    @classmethod
+    def from_cards(cls, cards: Sequence['cockatrice.Card']) -> 'CardTable':
+        """
+        Builds a table from a list of cards
+
+        Parameters:
+            cards (Sequence[Card]): Cards to store, in row order
+
+        Returns:
+            CardTable: Table with one row per card
+        """
+
+        _require_numpy()
+        return cls(
+            cmc=numpy.array([card_obj.cmc for card_obj in cards], dtype="int16"),
+            color_ids=Categories((card_obj.color_id for card_obj in cards), dtype="uint8", known_values=COLOR_IDS),
+            multicolor_ids=Categories((card_obj.multicolor_id for card_obj in cards), dtype="uint8"),
+            types=Categories(card_obj.type for card_obj in cards),
+            functions=Categories(card_obj.function for card_obj in cards),
+            colors=Categories(card_obj.color if card_obj.color is None or isinstance(card_obj.color, str)
+                              else ",".join(c or "" for c in card_obj.color) for card_obj in cards),
+            names=StringPool(card_obj.name for card_obj in cards),
+            manacosts=StringPool(card_obj.manacost for card_obj in cards),
+            card_texts=StringPool(card_obj.card_text for card_obj in cards),
+            supertypes=StringPool(f" {' '.join(card_obj.supertype)} " for card_obj in cards),
+            subtypes=StringPool(f" {' '.join(card_obj.subtype)} " for card_obj in cards),
+        )
+
+    def __len__(self) -> int:
+        return len(self.cmc)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the columns, in bytes (string pools counted at one byte per character)
+        """
+
+        total = self.cmc.nbytes
+        for column in (self.color_ids, self.multicolor_ids, self.types, self.functions, self.colors):
+            total += column.codes.nbytes
+        for pool in (self.names, self.manacosts, self.card_texts, self.supertypes, self.subtypes):
+            total += pool.offsets.nbytes + pool.missing.nbytes + len(pool.text)
+        return total
+
+    def card(self, index: int) -> 'cockatrice.Card':
+        """
+        Rebuilds the Card stored in a row
+
+        Parameters:
+            index (int): Row number
+
+        Returns:
+            Card: New Card object with the row's values
+        """
+
+        color = self.colors[index]
+        if color is not None and "," in color:
+            color = color.split(",")
+        return cockatrice.Card(self.names[index], color, self.manacosts[index], int(self.cmc[index]),
+                               self.types[index], self.supertypes[index].split(), self.subtypes[index].split(),
+                               self.card_texts[index], self.functions[index])
+
+    def mask(self,
+             color_id: Optional[str] = None,
+             multicolor_id: Optional[str] = None,
+             type: Optional[str] = None,
+             cmc_range: Optional[Tuple[int, int]] = None,
+             supertype: Optional[str] = None,
+             subtype: Optional[str] = None,
+             function: Optional[str] = None,
+             text: Optional[str] = None) -> 'numpy.ndarray':
+        """
+        Returns a boolean mask of the rows matching every given filter
+
+        Parameters:
+            color_id (Optional[str]): Color id (one of COLOR_IDS)
+            multicolor_id (Optional[str]): Multicolor id, e.g. "UW"
+            type (Optional[str]): Card type, e.g. "Creature"
+            cmc_range (Optional[Tuple[int, int]]): Inclusive range of converted mana costs
+            supertype (Optional[str]): Supertype the card must have, e.g. "Legendary"
+            subtype (Optional[str]): Subtype the card must have, e.g. "Wizard"
+            function (Optional[str]): Card function
+            text (Optional[str]): Text that must appear in the card text
+
+        Returns:
+            numpy.ndarray: Boolean mask with one entry per row
+        """
+
+        mask = numpy.ones(len(self), dtype=bool)
+        if color_id is not None:
+            mask &= self.color_ids.mask(color_id)
+        if multicolor_id is not None:
+            mask &= self.multicolor_ids.mask(multicolor_id)
+        if type is not None:
+            mask &= self.types.mask(type)
+        if function is not None:
+            mask &= self.functions.mask(function)
+        if cmc_range is not None:
+            mask &= (self.cmc >= cmc_range[0]) & (self.cmc <= cmc_range[1])
+        if supertype is not None:
+            mask &= self.supertypes.contains(f" {supertype} ")
+        if subtype is not None:
+            mask &= self.subtypes.contains(f" {subtype} ")
+        if text is not None:
+            mask &= self.card_texts.contains(text)
+        return mask
+
+    def rows(self, **filters) -> 'numpy.ndarray':
+        """
+        Returns the row numbers matching every given filter (see CardTable.mask)
+        """
+
+        return numpy.flatnonzero(self.mask(**filters))
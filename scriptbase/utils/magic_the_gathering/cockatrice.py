@@ -1,25 +1,342 @@
-import json
+import array
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import os
 import pickle
-import xmltodict
+import shutil
+import sys
+import xml.etree.ElementTree as ElementTree
+
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import scriptbase.utils.algorithms.edit_distance as edit_distance
+import scriptbase.utils.file_handling.file_utils as file_utils
+import scriptbase.utils.magic_the_gathering.text_index as text_index
+
+
+NAME_GRAM_SIZE = 3
+
+## Attributes CockatriceDatabase.query can filter on by equality
+QUERY_ATTRIBUTES = ("color", "color_id", "multicolor_id", "type", "supertype", "subtype", "cmc")
+
+## Bump whenever the attributes of CockatriceDatabase or Card change, so old snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+
+def normalize_card_name(name: str) -> str:
+    """
+    Normalizes a card name so that differences in case, accents, punctuation and
+    spacing (including underscores used in place of spaces in file names) are ignored
+
+    Parameters:
+        name (str): Card name
+
+    Returns:
+        str: Normalized card name
+    """
+
+    return " ".join(text_index.tokenize(name))
+
+
+def name_grams(normalized_name: str) -> Set[str]:
+    """
+    Returns the set of NAME_GRAM_SIZE-grams of a normalized card name, padded so that
+    the start and end of the name count as well
+
+    Parameters:
+        normalized_name (str): Card name, see normalize_card_name
+
+    Returns:
+        Set[str]: Set of n-grams
+    """
+
+    padding = "$" * (NAME_GRAM_SIZE - 1)
+    padded_name = padding + normalized_name + padding
+    return {padded_name[i:i + NAME_GRAM_SIZE] for i in range(len(padded_name) - NAME_GRAM_SIZE + 1)}
+
+
+def iter_xml_card_dicts(path: str) -> Iterator[dict]:
+    """
+    Streams the <card> elements of a Cockatrice XML file as dictionaries of tag to text,
+    without ever holding the whole document in memory. Each element is cleared once it has
+    been read.
+
+    Tags that appear more than once in a card (e.g. <color>) map to a list of their values.
+    Children of a <prop> element (newer Cockatrice formats) are treated as children of the card.
+
+    Parameters:
+        path (str): Path to the Cockatrice XML file
+
+    Yields:
+        dict: Dictionary describing one card
+    """
+
+    parent_elements = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            parent_elements.append(element)
+            continue
+
+        parent_elements.pop()
+        if element.tag != "card":
+            # Anything outside a card (e.g. <set> info) is not needed once it has been parsed
+            if element.tag in ("set", "sets") and parent_elements:
+                parent_elements[-1].remove(element)
+            continue
+
+        card_dict = {}
+        for child in element:
+            fields = child if child.tag == "prop" else (child,)
+            for field in fields:
+                value = field.text.strip() if field.text is not None else None
+                if field.tag in card_dict:
+                    if not isinstance(card_dict[field.tag], list):
+                        card_dict[field.tag] = [card_dict[field.tag]]
+                    card_dict[field.tag].append(value)
+                else:
+                    card_dict[field.tag] = value
+
+        # Drop the card from its parent so processed cards don't accumulate
+        element.clear()
+        if parent_elements:
+            parent_elements[-1].remove(element)
+
+        yield card_dict
+
+
+def card_tuple_from_dict(card_dict: dict) -> Optional[tuple]:
+    """
+    Extracts the arguments for a Card (see Card.from_tuple) from a dictionary describing a card in a
+    Cockatrice XML file (see iter_xml_card_dicts)
+
+    Parameters:
+        card_dict (dict): Dictionary of tag to text
+
+    Returns:
+        Optional[tuple]: The card's arguments, or None if it is a token
+    """
+
+    if "token" in card_dict:
+        return None
+
+    supertype_data = card_dict["type"].split(" ")
+    supertypes = []
+    subtypes = []
+    u2014 = False
+    for t in supertype_data:
+        if t == "\u2014":
+            u2014 = True
+        elif u2014:
+            subtypes.append(t)
+        else:
+            supertypes.append(t)
+
+    color = card_dict["color"] if "color" in card_dict else "C"
+    non_type_supertypes = supertypes[0:-1] if len(supertypes) > 1 else []
+    Type = supertypes[-1]
+    return (card_dict["name"], color, card_dict.get("manacost"), card_dict["cmc"], Type, non_type_supertypes,
+            subtypes, card_dict.get("text"), "null")
+
+
+def card_from_dict(card_dict: dict) -> Optional['Card']:
+    """
+    Builds a Card from a dictionary describing a card in a Cockatrice XML file (see iter_xml_card_dicts)
+
+    Parameters:
+        card_dict (dict): Dictionary of tag to text
+
+    Returns:
+        Optional[Card]: The card, or None if it is a token
+    """
+
+    card_tuple = card_tuple_from_dict(card_dict)
+    return Card.from_tuple(card_tuple) if card_tuple is not None else None
+
+
+def snapshot_path_for(path: str, cache_dir: str) -> str:
+    """
+    Returns where the snapshot of a Cockatrice XML is kept in cache_dir. The name includes a hash
+    of the XML's absolute path, so XMLs with the same file name don't collide.
+    """
+
+    absolute_path = os.path.abspath(path)
+    snapshot_name = f"{os.path.basename(path)}-{hashlib.sha256(absolute_path.encode('utf-8')).hexdigest()[:16]}"
+    return os.path.join(cache_dir, snapshot_name + ".snapshot")
+
+
+def read_snapshot(snapshot_path: str, source: dict) -> Optional['CockatriceDatabase']:
+    """
+    Reads the database from a snapshot written by write_snapshot, if it was made from the described source file.
+
+    A snapshot is reused if the XML's size and mtime match those recorded in it, or failing
+    that if its content hash does. In the latter case the new mtime is recorded, so the next read
+    doesn't hash the XML again. Snapshots from a different SNAPSHOT_VERSION are ignored.
+
+    Parameters:
+        snapshot_path (str): Path to the snapshot
+        source (dict): Path, size and mtime of the source XML. Its hash is filled in if it has to be computed
+
+    Returns:
+        Optional[CockatriceDatabase]: The database, or None if there is no usable snapshot
+    """
+
+    try:
+        with open(snapshot_path, "rb") as F:
+            # The header is pickled on its own so a stale snapshot can be rejected without reading the database
+            header = pickle.load(F)
+            if header.get("version") != SNAPSHOT_VERSION or header.get("size") != source["size"]:
+                return None
+            if header.get("mtime") != source["mtime"]:
+                if source["hash"] is None:
+                    source["hash"] = file_utils.file_digest(source["path"])
+                if header.get("hash") != source["hash"]:
+                    return None
+                header["mtime"] = source["mtime"]
+                refresh_snapshot_header(snapshot_path, header, F)
+            return pickle.load(F)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, TypeError, ImportError, ValueError):
+        # ImportError: a class in the snapshot has moved. ValueError: e.g. an unsupported pickle protocol
+        return None
+
+
+def refresh_snapshot_header(snapshot_path: str, header: dict, snapshot_file):
+    """
+    Replaces the header of a snapshot, keeping the pickled database that follows it. The header is
+    overwritten in place when the new one is the same size, and the snapshot is copied otherwise.
+    Failures are ignored, as the snapshot is still usable with its old header.
+
+    Parameters:
+        snapshot_path (str): Path to the snapshot
+        header (dict): New header
+        snapshot_file: The snapshot, open for reading and positioned just after its current header.
+                       It is left at the same position
+    """
+
+    pickled_header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    payload_start = snapshot_file.tell()
+    try:
+        if len(pickled_header) == payload_start:
+            with open(snapshot_path, "r+b") as F:
+                F.write(pickled_header)
+            return
+
+        temporary_path = snapshot_path + ".tmp"
+        with open(temporary_path, "wb") as F:
+            F.write(pickled_header)
+            shutil.copyfileobj(snapshot_file, F)
+        os.replace(temporary_path, snapshot_path)
+    except OSError:
+        pass
+    finally:
+        snapshot_file.seek(payload_start)
+
+
+def write_snapshot(snapshot_path: str, source: dict, database: 'CockatriceDatabase'):
+    """
+    Writes a database, indexes included, to a snapshot that read_snapshot can read back
+
+    Parameters:
+        snapshot_path (str): Path to write the snapshot to
+        source (dict): Path, size, mtime and hash of the source XML
+        database (CockatriceDatabase): Database built from the source XML
+    """
+
+    header = {"version": SNAPSHOT_VERSION, "size": source["size"], "mtime": source["mtime"], "hash": source["hash"]}
+
+    temporary_path = snapshot_path + ".tmp"
+    with open(temporary_path, "wb") as F:
+        pickle.dump(header, F, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(database, F, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, snapshot_path)
+
+
+def xml_card_tuples(path: str, cache_dir: Optional[str] = None) -> List[tuple]:
+    """
+    Reads the cards in a Cockatrice XML file as tuples (see Card.from_tuple), which are cheap to
+    pickle between processes. If cache_dir is given, the cards are taken from the file's snapshot
+    (see CockatriceDatabase.from_xml).
+
+    Parameters:
+        path (str): Path to the Cockatrice XML file
+        cache_dir (Optional[str]): Folder to keep snapshots in, or None to always parse the XML
+
+    Returns:
+        List[tuple]: Card tuples in file order, tokens excluded
+    """
+
+    if cache_dir is None:
+        return [t for t in map(card_tuple_from_dict, iter_xml_card_dicts(path)) if t is not None]
+
+    return [card_obj.as_tuple() for card_obj in CockatriceDatabase.from_xml(path, cache_dir).set_list]
+
+
+def intern_optional(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
 
 
 class Card:
 
+    # A large card database holds tens of thousands of these, so skip the per-instance __dict__
+    __slots__ = ("name", "color", "manacost", "cmc", "type", "supertype", "subtype", "card_text", "function",
+                 "color_id", "multicolor_id")
+
     def __init__(self, name: str, color: str, manacost: str, cmc: str, Type: str, supertype: list, subtype: list, card_text: str, function: str):
         self.name = name
-        self.color = color
-        self.manacost = manacost
+        ## An empty <color> element gives None, either on its own or inside a list of colors
+        if color is None or isinstance(color, str):
+            self.color = intern_optional(color)
+        else:
+            self.color = tuple(intern_optional(c) for c in color)
+        self.manacost = intern_optional(manacost)
         self.cmc = int(cmc)
-        self.type = Type
-        self.supertype = supertype
-        self.subtype = subtype
+        ## Types, colors and functions repeat across thousands of cards, so every card shares one copy of each
+        self.type = intern_optional(Type)
+        self.supertype = tuple(sys.intern(t) for t in supertype)
+        self.subtype = tuple(sys.intern(t) for t in subtype)
         self.card_text = card_text
-        self.function = function
+        self.function = intern_optional(function)
 
         self.color_id = self.get_color_id()
-        self.multicolor_id = list(self.get_multicolor_id())
-        self.multicolor_id.sort()
-        self.multicolor_id = "".join(self.multicolor_id)
+        self.multicolor_id = self.get_multicolor_id()
+
+    def as_tuple(self) -> tuple:
+        """
+        Returns the arguments needed to rebuild this card with Card.from_tuple
+        """
+
+        return (self.name, self.color, self.manacost, self.cmc, self.type, self.supertype, self.subtype,
+                self.card_text, self.function)
+
+    @classmethod
+    def from_tuple(cls, card_tuple: tuple) -> 'Card':
+        """
+        Rebuilds a card from the output of Card.as_tuple
+        """
+
+        return cls(*card_tuple)
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled card. Cards pickled before Card had __slots__ (e.g. in the set_data.dat
+        read by CockatriceDatabase.load) carry their attributes as a plain dict, and are rebuilt
+        from it so the interned and derived attributes are filled in as well.
+        """
+
+        if isinstance(state, tuple):
+            # (None, slot values), as pickled from a Card with __slots__
+            for attribute, value in state[1].items():
+                setattr(self, attribute, value)
+            return
+
+        self.__init__(state["name"], state["color"], state["manacost"], state["cmc"], state["type"],
+                      state["supertype"], state["subtype"], state["card_text"], state["function"])
 
     def get_cmc(self):
         cmc = 0
@@ -48,7 +365,7 @@ class Card:
         elif len(unique_pips) == 0:
             return "C"
         else:
-            return unique_pips
+            return sys.intern(unique_pips)
 
     def __repr__(self):
         return f"{self.type} @ {self.manacost} : {self.function}"
@@ -56,18 +373,21 @@ class Card:
     def get_multicolor_id(self):
         if self.color_id != "M":
             return ""
-        unique_pips = ""
-        for pip in self.manacost:
-            if pip in "WUBRG" and pip not in unique_pips:
-                unique_pips += pip
-        return unique_pips
+        ## Pips in alphabetical order, so every card of a color pair shares the same key
+        return sys.intern("".join(sorted({pip for pip in self.manacost if pip in "WUBRG"})))
 
 
 class CockatriceDatabase:
 
     path = "dump.dat"
 
-    def __init__(self):
+    def __init__(self, text_index: bool = False):
+        """
+        Parameters:
+            text_index (bool): Index card names and text for search_text as cards are added. Otherwise the
+                               index is built on the first search, so databases that are never searched skip it
+        """
+
         self.set_data = {
             "W": {},
             "U": {},
@@ -81,6 +401,25 @@ class CockatriceDatabase:
         self.set_list = []
         self.card_data = {}
 
+        ## (multicolor_id, cmc, name) of every multicolor card, so add can spot duplicates without scanning a bucket
+        self.multicolor_keys = set()
+
+        ## attribute -> value -> set of card ids (positions in set_list), for query
+        self.query_indexes: Dict[str, Dict[object, Set[int]]] = {attribute: {} for attribute in QUERY_ATTRIBUTES}
+
+        ## Running counts behind get_summary_stats, updated by add and set_function
+        self.reset_summary_stats()
+
+        ## Full-text index over card names and rules text, for search_text (None until built)
+        self.text_index = None
+        if text_index:
+            self.build_text_index()
+
+        ## Indexes for resolve_card_name. Posting arrays hold positions in name_keys rather than the names themselves
+        self.normalized_names = {}
+        self.name_keys: List[str] = []
+        self.name_gram_index: Dict[str, array.array] = {}
+
     def add(self, card_obj: Card):
         if card_obj.color_id != "M":
             if card_obj.cmc not in self.set_data[card_obj.color_id]:
@@ -94,110 +433,432 @@ class CockatriceDatabase:
             if card_obj.cmc not in self.set_data["M"][card_obj.multicolor_id]:
                 self.set_data["M"][card_obj.multicolor_id][card_obj.cmc] = []
 
-            for card_in_data in self.set_data["M"][card_obj.multicolor_id][card_obj.cmc]:
-                if card_in_data.name == card_obj.name:
-                    return False
-            else:
-                self.set_data["M"][card_obj.multicolor_id][card_obj.cmc].append(card_obj)
+            multicolor_key = (card_obj.multicolor_id, card_obj.cmc, card_obj.name)
+            if multicolor_key in self.multicolor_keys:
+                return False
+            self.multicolor_keys.add(multicolor_key)
+            self.set_data["M"][card_obj.multicolor_id][card_obj.cmc].append(card_obj)
         self.set_list.append(card_obj)
         self.card_data[card_obj.name] = card_obj
+        self.index_card_name(card_obj.name)
+        self.index_card_attributes(len(self.set_list) - 1, card_obj)
+        self.count_card(card_obj)
+        if self.text_index is not None:
+            self.text_index.add(len(self.set_list) - 1, (card_obj.name, card_obj.card_text))
+
+    def index_card_attributes(self, card_id: int, card_obj: Card):
+        """
+        Adds a card to the attribute indexes used by query
+        """
+
+        colors = card_obj.multicolor_id if card_obj.color_id == "M" else card_obj.color_id
+        values = {
+            "color": colors,
+            "color_id": (card_obj.color_id,),
+            "multicolor_id": (card_obj.multicolor_id,) if card_obj.multicolor_id else (),
+            "type": (card_obj.type,),
+            "supertype": card_obj.supertype,
+            "subtype": card_obj.subtype,
+            "cmc": (card_obj.cmc,),
+        }
+        for attribute, attribute_values in values.items():
+            index = self.query_indexes[attribute]
+            for value in attribute_values:
+                index.setdefault(value, set()).add(card_id)
+
+    def build_text_index(self):
+        """
+        Indexes the names and text of the cards added so far for search_text. Cards added afterwards
+        are indexed by add.
+        """
+
+        self.text_index = text_index.TextIndex()
+        for card_id, card_obj in enumerate(self.set_list):
+            self.text_index.add(card_id, (card_obj.name, card_obj.card_text))
+
+    def search_text(self, query: str) -> List[Card]:
+        """
+        Searches card names and rules text, e.g.
+            database.search_text('"draw a card" flying OR reach')
+
+        Phrases go in double quotes, a trailing "*" matches any word with that prefix, and terms are
+        ANDed unless separated by OR (see TextIndex). Case, accents and punctuation are ignored.
+        The first search builds the text index if the database was made without text_index=True.
+
+        Parameters:
+            query (str): Search query
+
+        Returns:
+            List[Card]: Matching cards, in the order they were added
+        """
+
+        if self.text_index is None:
+            self.build_text_index()
+        return [self.set_list[card_id] for card_id in self.text_index.search(query)]
+
+    def query(self, cmc_range: Optional[Tuple[int, int]] = None, **filters) -> List[Card]:
+        """
+        Finds every card matching all the given filters, e.g.
+            database.query(color="U", type="Creature", cmc_range=(2, 4), subtype="Wizard")
+
+        Each filter is looked up in its inverted index, and the resulting id sets are intersected
+        smallest first so the work is bounded by the most selective filter. cmc_range is only
+        expanded into a union of cmc buckets if that is cheaper than checking the cmc of each
+        remaining card.
+
+        Parameters:
+            cmc_range (Optional[Tuple[int, int]]): Inclusive range of converted mana costs
+            filters: Values to match, keyed by one of QUERY_ATTRIBUTES. "color" matches any card with
+                     that color, including multicolor cards; "color_id" matches Card.color_id exactly
+
+        Returns:
+            List[Card]: Matching cards, in the order they were added
+        """
+
+        for attribute in filters:
+            if attribute not in QUERY_ATTRIBUTES:
+                raise ValueError(f"Cannot query on {attribute}, expected one of {', '.join(QUERY_ATTRIBUTES)}")
+
+        id_sets = sorted((self.query_indexes[attribute].get(value, set()) for attribute, value in filters.items()),
+                         key=len)
+
+        if cmc_range is not None:
+            low, high = cmc_range
+            cmc_buckets = [ids for cmc, ids in self.query_indexes["cmc"].items() if low <= cmc <= high]
+            range_size = sum(len(ids) for ids in cmc_buckets)
+            if not id_sets or range_size < len(id_sets[0]):
+                id_sets.insert(0, set().union(*cmc_buckets))
+                cmc_range = None
+
+        if not id_sets:
+            card_ids = range(len(self.set_list))
+        else:
+            card_ids = id_sets[0]
+            for ids in id_sets[1:]:
+                if not card_ids:
+                    break
+                card_ids = card_ids & ids
+            card_ids = sorted(card_ids)
+
+        cards = [self.set_list[card_id] for card_id in card_ids]
+        if cmc_range is not None:
+            cards = [card_obj for card_obj in cards if cmc_range[0] <= card_obj.cmc <= cmc_range[1]]
+        return cards
+
+    def index_card_name(self, name: str):
+        """
+        Adds a card name to the normalized name and n-gram indexes used by resolve_card_name
+        """
+
+        normalized_name = normalize_card_name(name)
+        if normalized_name in self.normalized_names:
+            return
+        self.normalized_names[normalized_name] = name
+
+        name_id = len(self.name_keys)
+        self.name_keys.append(normalized_name)
+        for gram in name_grams(normalized_name):
+            postings = self.name_gram_index.get(gram)
+            if postings is None:
+                postings = self.name_gram_index[gram] = array.array("l")
+            postings.append(name_id)
+
+    def resolve_card_name(self, name: str, max_distance: Optional[int] = None,
+                          candidates_to_rank: int = 8) -> Optional[Card]:
+        """
+        Finds the card best matching name, tolerating differences in case and punctuation as well
+        as small typos.
+
+        Exact and normalized matches are looked up directly. Otherwise, candidates are drawn from the
+        n-gram index: a name within max_distance edits of the query shares all but at most
+        NAME_GRAM_SIZE * max_distance of its n-grams, so it must contain one of the rarest
+        NAME_GRAM_SIZE * max_distance + 1 n-grams of the query, and only names in those posting
+        arrays are considered. The n-grams each candidate of a plausible length shares with the query
+        are counted from the query's posting arrays, and the best few are ranked by edit distance.
+
+        Parameters:
+            name (str): Card name to look up
+            max_distance (Optional[int]): Largest edit distance (between normalized names) to accept.
+                                          Defaults to a quarter of the name's length, and at least 1
+            candidates_to_rank (int): Number of candidates to compute the edit distance for
+
+        Returns:
+            Optional[Card]: Best matching card, or None if nothing is close enough
+        """
+
+        card = self.card_data.get(name)
+        if card is not None:
+            return card
+
+        normalized_name = normalize_card_name(name)
+        if normalized_name in self.normalized_names:
+            return self.card_data[self.normalized_names[normalized_name]]
+
+        if max_distance is None:
+            max_distance = max(1, len(normalized_name) // 4)
+
+        query_grams = name_grams(normalized_name)
+        required_shared = len(query_grams) - NAME_GRAM_SIZE * max_distance
+        rarest_grams = sorted(query_grams, key=lambda g: len(self.name_gram_index.get(g, ())))
+        if required_shared > 0:
+            rarest_grams = rarest_grams[:len(query_grams) - required_shared + 1]
+
+        name_length = len(normalized_name)
+        shared_counts = {}
+        for gram in rarest_grams:
+            for candidate_id in self.name_gram_index.get(gram, ()):
+                if candidate_id not in shared_counts and abs(len(self.name_keys[candidate_id]) - name_length) <= max_distance:
+                    shared_counts[candidate_id] = 0
+
+        ## Count the n-grams each candidate shares with the query from the query's posting arrays. Ids are added in
+        ## increasing order, so a posting array much longer than the candidate list can be binary searched instead
+        for gram in query_grams:
+            postings = self.name_gram_index.get(gram, ())
+            if len(postings) <= len(shared_counts) * 8:
+                for candidate_id in postings:
+                    if candidate_id in shared_counts:
+                        shared_counts[candidate_id] += 1
+                continue
+            for candidate_id in shared_counts:
+                position = bisect.bisect_left(postings, candidate_id)
+                if position < len(postings) and postings[position] == candidate_id:
+                    shared_counts[candidate_id] += 1
 
-    def parse_xml(self, path="DND/DND.xml"):
-        with open(path, "r", encoding="utf-8") as F:
-            xml_data = F.read().strip()
-
-        parsed = json.loads(json.dumps(xmltodict.parse(xml_data)))['cockatrice_carddatabase']
-        # print(parsed)
-
-        for card_dict in parsed["cards"]["card"]:
-            supertype_data = card_dict["type"].split(" ")
-            supertypes = []
-            subtypes = []
-            u2014 = False
-            for t in supertype_data:
-                if t == "\u2014":
-                    u2014 = True
-                elif u2014:
-                    subtypes.append(t)
-                else:
-                    supertypes.append(t)
+        scored_candidates = [(-shared, self.name_keys[candidate_id]) for candidate_id, shared in shared_counts.items()
+                             if shared >= required_shared]
+        scored_candidates.sort()
+
+        best_distance, best_candidate = max_distance + 1, None
+        for _, candidate in scored_candidates[:candidates_to_rank]:
+            distance = edit_distance.numeric_edit_distance(normalized_name, candidate)
+            if distance < best_distance:
+                best_distance, best_candidate = distance, candidate
 
-            if "token" not in card_dict:
-                color = card_dict["color"] if "color" in card_dict else "C"
-                non_type_supertypes = supertypes[0:-1] if len(supertypes) > 1 else []
-                Type = supertypes[-1]
-                card_obj = Card(card_dict["name"], color, card_dict["manacost"], card_dict["cmc"], Type, non_type_supertypes, subtypes, card_dict["text"], "null")
+        if best_candidate is None:
+            return None
+        return self.card_data[self.normalized_names[best_candidate]]
+
+    def parse_xml(self, path="DND/DND.xml"):
+        # Cards are streamed one <card> element at a time, so memory use doesn't grow with the file size
+        for card_dict in iter_xml_card_dicts(path):
+            card_obj = card_from_dict(card_dict)
+            if card_obj is not None:
                 self.add(card_obj)
 
-    def get_summary_stats(self, data=None):
-        if data is None:
-            data = self.set_data
-        summary_data = {"overall_cmcs": {}, "overall_types":{}, "overall_functions":{}}
-        for key in data:
-            if key == "M":
-                multicolor_info = self.get_summary_stats(data=self.set_data["M"])
-                for key, item in multicolor_info.items():
-                    ## Treat each color combo as its own color.
-                    if "overall" not in key:
-                        summary_data[key] = item
-                    else:
-                        ## To get the summary statistics merged properly, the "overall_type" etc. must be merged
-                        ## iteratively.
-                        for o_key, o_item in multicolor_info[key].items():
-                            if o_key in summary_data[key]:
-                                summary_data[key][o_key] += o_item
-                            else:
-                                summary_data[key][o_key] = o_item
-            else:
-                summary_data[key] = {"types":{}, "functions":{}, "avg_cmc":0, "num":0, "cmcs":{}}
-                for cmc in data[key]:
-                    for card_obj in data[key][cmc]:
-                        if type(card_obj) == int:
-                            breakpoint()
-                        if card_obj.type == "Land":
-                            continue
-
-                        summary_data[key]["avg_cmc"] += int(cmc)
-                        summary_data[key]["num"] += 1
-
-                        ## Local keys
-                        if card_obj.function not in summary_data[key]["functions"]:
-                            summary_data[key]["functions"][card_obj.function] = 1
-                        else:
-                            summary_data[key]["functions"][card_obj.function] += 1
-
-                        if card_obj.type not in summary_data[key]["types"]:
-                            summary_data[key]["types"][card_obj.type] = 1
-                        else:
-                            summary_data[key]["types"][card_obj.type] += 1
-
-                        if cmc not in summary_data[key]["cmcs"]:
-                            summary_data[key]["cmcs"][cmc] = 1
-                        else:
-                            summary_data[key]["cmcs"][cmc] += 1
-
-
-                        ## Global keys
-                        if card_obj.function not in summary_data["overall_functions"]:
-                            summary_data["overall_functions"][card_obj.function] = 1
-                        else:
-                            summary_data["overall_functions"][card_obj.function] += 1
-
-                        if card_obj.type not in summary_data["overall_types"]:
-                            summary_data["overall_types"][card_obj.type] = 1
-                        else:
-                            summary_data["overall_types"][card_obj.type] += 1
-
-                        if cmc not in summary_data["overall_cmcs"]:
-                            summary_data["overall_cmcs"][cmc] = 1
-                        else:
-                            summary_data["overall_cmcs"][cmc] += 1
-                summary_data[key]["avg_cmc"] = summary_data[key]["avg_cmc"] / summary_data[key]["num"]
+    @classmethod
+    def from_card_tuples(cls, card_tuples: Sequence[tuple], text_index: bool = False) -> 'CockatriceDatabase':
+        """
+        Builds a database from card tuples (see Card.from_tuple), adding them in order
+        """
+
+        database = cls(text_index=text_index)
+        for card_tuple in card_tuples:
+            database.add(Card.from_tuple(card_tuple))
+        return database
+
+    @classmethod
+    def from_xml(cls, path: str, cache_dir: Optional[str] = None, text_index: bool = False) -> 'CockatriceDatabase':
+        """
+        Builds a database from a Cockatrice XML file, using a snapshot in cache_dir if one was
+        made from the same file (see read_snapshot). Otherwise the XML is parsed and the database,
+        indexes included, is written to a new snapshot.
+
+        Parameters:
+            path (str): Path to the Cockatrice XML file
+            cache_dir (Optional[str]): Folder to keep snapshots in, or None to always parse the XML
+            text_index (bool): Build the index for search_text while loading (see CockatriceDatabase)
+
+        Returns:
+            CockatriceDatabase: Database of the cards in the XML
+        """
+
+        if cache_dir is None:
+            database = cls(text_index=text_index)
+            database.parse_xml(path=path)
+            return database
+
+        stat = os.stat(path)
+        source = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": None}
+        snapshot_path = snapshot_path_for(path, cache_dir)
+
+        database = read_snapshot(snapshot_path, source)
+        if isinstance(database, cls):
+            if text_index and database.text_index is None:
+                database.build_text_index()
+            return database
+
+        database = cls(text_index=text_index)
+        database.parse_xml(path=path)
+        if source["hash"] is None:
+            source["hash"] = file_utils.file_digest(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        write_snapshot(snapshot_path, source, database)
+        return database
+
+    @classmethod
+    def load_many(cls, paths: Sequence[str], jobs: Optional[int] = None,
+                  cache_dir: Optional[str] = None, text_index: bool = False) -> 'CockatriceDatabase':
+        """
+        Builds one database from several Cockatrice XML files, parsing them in parallel.
+
+        Each file is parsed in a worker process into a list of card tuples, and the batches are
+        merged in the order the paths were given. If a card name appears in more than one file,
+        only the copies from the last file containing it are kept, so e.g. custom sets listed after
+        the official catalog override its cards. The result does not depend on which worker finishes first.
+        A single file is loaded with from_xml, so its snapshot is used as is.
+
+        Parameters:
+            paths (Sequence[str]): Paths to the Cockatrice XML files, lowest priority first
+            jobs (Optional[int]): Number of processes to parse with. Defaults to one per file, up to the number of CPUs
+            cache_dir (Optional[str]): Folder to keep snapshots in (see from_xml), or None to always parse the XMLs
+            text_index (bool): Build the index for search_text while loading (see CockatriceDatabase)
+
+        Returns:
+            CockatriceDatabase: Database of the cards in all the XMLs
+        """
+
+        if len(paths) == 1:
+            return cls.from_xml(paths[0], cache_dir=cache_dir, text_index=text_index)
+
+        if jobs is None:
+            jobs = min(len(paths), os.cpu_count() or 1)
+
+        if jobs <= 1 or len(paths) <= 1:
+            batches = [xml_card_tuples(path, cache_dir) for path in paths]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                batches = list(executor.map(xml_card_tuples, paths, [cache_dir] * len(paths)))
+
+        last_batch = {}
+        for batch_index, batch in enumerate(batches):
+            for card_tuple in batch:
+                last_batch[card_tuple[0]] = batch_index
+
+        return cls.from_card_tuples((card_tuple for batch_index, batch in enumerate(batches)
+                                     for card_tuple in batch if last_batch[card_tuple[0]] == batch_index),
+                                    text_index=text_index)
+
+    def reset_summary_stats(self):
+        """
+        Clears the counts behind get_summary_stats
+        """
+
+        self.overall_stats = {"overall_cmcs": collections.Counter(), "overall_types": collections.Counter(),
+                              "overall_functions": collections.Counter()}
+        ## color id (or multicolor id for multicolor cards) -> counts for cards of that color
+        self.color_stats = {}
+
+    def rebuild_summary_stats(self):
+        """
+        Recounts get_summary_stats from set_data, e.g. after set_data was replaced wholesale by load
+        """
+
+        self.reset_summary_stats()
+        for key, cards_by_cmc in self.set_data.items():
+            buckets = cards_by_cmc.values() if key != "M" else [
+                bucket for combo_data in cards_by_cmc.values() for bucket in combo_data.values()]
+            for bucket in buckets:
+                for card_obj in bucket:
+                    self.count_card(card_obj)
+
+    def count_card(self, card_obj: Card, count: int = 1):
+        """
+        Adds a card to (or with count=-1, removes it from) the counts behind get_summary_stats.
+        Lands are not counted.
+        """
+
+        if card_obj.type == "Land":
+            return
+
+        key = card_obj.multicolor_id if card_obj.color_id == "M" else card_obj.color_id
+        if key not in self.color_stats:
+            self.color_stats[key] = {"types": collections.Counter(), "functions": collections.Counter(),
+                                     "cmc_total": 0, "num": 0, "cmcs": collections.Counter()}
+        stats = self.color_stats[key]
+
+        stats["num"] += count
+        stats["cmc_total"] += count * card_obj.cmc
+        for counter, overall_counter, value in ((stats["types"], "overall_types", card_obj.type),
+                                                (stats["functions"], "overall_functions", card_obj.function),
+                                                (stats["cmcs"], "overall_cmcs", card_obj.cmc)):
+            counter[value] += count
+            self.overall_stats[overall_counter][value] += count
+
+    def set_function(self, card_obj: Card, function: str):
+        """
+        Changes a card's function, keeping get_summary_stats up to date. Assigning Card.function
+        directly bypasses the counts.
+
+        Parameters:
+            card_obj (Card): Card in this database
+            function (str): New function
+        """
+
+        self.count_card(card_obj, count=-1)
+        card_obj.function = intern_optional(function)
+        self.count_card(card_obj)
+
+    def get_summary_stats(self) -> dict:
+        """
+        Summarises the non-land cards in the database. Each color (and each multicolor combination,
+        treated as its own color) maps to its types, functions, cmcs, number of cards and average cmc;
+        "overall_cmcs", "overall_types" and "overall_functions" count across all colors.
+
+        The counts are kept up to date as cards are added, so this only copies them out and its cost
+        does not depend on the number of cards.
+
+        Returns:
+            dict: Summary statistics
+        """
+
+        def counts(counter):
+            return {value: count for value, count in counter.items() if count}
+
+        summary_data = {key: counts(counter) for key, counter in self.overall_stats.items()}
+        color_keys = []
+        for key in self.set_data:
+            color_keys.extend(self.set_data["M"] if key == "M" else (key,))
+
+        for key in color_keys:
+            stats = self.color_stats.get(key)
+            if stats is None:
+                if key in self.set_data["M"]:
+                    continue
+                summary_data[key] = {"types": {}, "functions": {}, "avg_cmc": 0, "num": 0, "cmcs": {}}
+                continue
+            summary_data[key] = {
+                "types": counts(stats["types"]),
+                "functions": counts(stats["functions"]),
+                "avg_cmc": stats["cmc_total"] / stats["num"] if stats["num"] else 0,
+                "num": stats["num"],
+                "cmcs": counts(stats["cmcs"]),
+            }
         return summary_data
 
+    def cmc_histogram(self) -> Tuple[List[str], 'numpy.ndarray']:
+        """
+        Returns the cmc counts of the non-land cards as a NumPy array, one row per color (or
+        multicolor combination) and one column per cmc from 0 up to the largest cmc
+
+        Returns:
+            Tuple[List[str], numpy.ndarray]: Color of each row, and the histogram
+        """
+
+        if numpy is None:
+            raise ImportError("cmc_histogram requires numpy (pip install numpy)")
+
+        color_keys = list(self.color_stats)
+        max_cmc = max((cmc for stats in self.color_stats.values() for cmc in stats["cmcs"]), default=0)
+        histogram = numpy.zeros((len(color_keys), max_cmc + 1), dtype="int64")
+        for row, key in enumerate(color_keys):
+            for cmc, count in self.color_stats[key]["cmcs"].items():
+                histogram[row, cmc] += count
+        return color_keys, histogram
+
     def load(self):
         with open("OUTPUT/set_data.dat","rb") as F:
             self.set_data = pickle.load(F)
+        self.rebuild_summary_stats()
 
     def define_functions(self, colors=tuple("WUBRGMC"), override_current_func=False, data=None, search=None):
         if data is None:
@@ -224,5 +885,5 @@ class CockatriceDatabase:
                             break
                         confirm = input(f"(Please confirm function is: {function} [Y/n]) >> ")
                         if confirm.lower() == "y":
-                            card_obj.function = function.lower()
+                            self.set_function(card_obj, function.lower())
                             break
@@ -0,0 +1,185 @@
+import array
+import bisect
+import re
+import unicodedata
+
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+
+QUERY_TOKEN_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+
+## For ASCII text, tokenize maps underscores and whitespace to spaces and deletes other punctuation in one translate
+ASCII_TOKEN_TABLE = {code: (" " if chr(code) == "_" or chr(code).isspace() else None)
+                     for code in range(128) if not chr(code).isalnum()}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase words, ignoring accents and punctuation (so "Opponent's" -> "opponents"
+    and "{T}:" -> "t"). Underscores count as spaces.
+
+    Parameters:
+        text (str): Text to split
+
+    Returns:
+        List[str]: Words in order
+    """
+
+    if text.isascii():
+        return text.translate(ASCII_TOKEN_TABLE).lower().split()
+
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[_\s]+", " ", text)
+    text = re.sub(r"[^a-z\d ]", "", text)
+    return text.split()
+
+
+class TextIndex:
+    """
+    Positional inverted index over the names and rules text of cards.
+
+    Each term maps to a sorted array of the ids of the documents containing it, alongside the
+    positions of the term in each of them. Ids must be added in increasing order, which keeps the
+    posting arrays sorted without any re-sorting.
+
+    A document's fields (e.g. name then text) are indexed one after another with a gap of one
+    position between them, so a phrase never matches across two fields.
+
+    Queries (see TextIndex.search) support phrases in double quotes, prefixes ending in "*", and
+    AND (implicit between terms) / OR, with AND binding tighter:
+        flying OR reach
+        "draw a card" flash*
+    """
+
+    def __init__(self):
+        self.term_ids: Dict[str, array.array] = {}
+        self.term_positions: Dict[str, List[Tuple[int, ...]]] = {}
+        self.document_count = 0
+        self._sorted_terms: Optional[List[str]] = None
+
+    def add(self, document_id: int, fields: Sequence[Optional[str]]):
+        """
+        Indexes a document
+
+        Parameters:
+            document_id (int): Id of the document, larger than any id added before
+            fields (Sequence[Optional[str]]): Text of each field, None for missing fields
+        """
+
+        term_positions: Dict[str, List[int]] = {}
+        position = 0
+        for field in fields:
+            if field is None:
+                continue
+            for token in tokenize(field):
+                term_positions.setdefault(token, []).append(position)
+                position += 1
+            position += 1
+
+        for term, positions in term_positions.items():
+            if term not in self.term_ids:
+                self.term_ids[term] = array.array("l")
+                self.term_positions[term] = []
+                self._sorted_terms = None
+            self.term_ids[term].append(document_id)
+            self.term_positions[term].append(tuple(positions))
+        self.document_count += 1
+
+    def _positions(self, term: str, document_id: int) -> Tuple[int, ...]:
+        ids = self.term_ids[term]
+        return self.term_positions[term][bisect.bisect_left(ids, document_id)]
+
+    def term(self, term: str) -> Set[int]:
+        """
+        Returns the ids of documents containing a (tokenized) term
+        """
+
+        return set(self.term_ids.get(term, ()))
+
+    def prefix(self, prefix: str) -> Set[int]:
+        """
+        Returns the ids of documents containing a term starting with prefix
+        """
+
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.term_ids)
+
+        document_ids = set()
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(prefix):
+                break
+            document_ids.update(self.term_ids[term])
+        return document_ids
+
+    def phrase(self, terms: Sequence[str]) -> Set[int]:
+        """
+        Returns the ids of documents containing the (tokenized) terms consecutively and in order
+        """
+
+        if not terms:
+            return set()
+        if len(terms) == 1:
+            return self.term(terms[0])
+        if any(term not in self.term_ids for term in terms):
+            return set()
+
+        ## Check positions only in documents that contain every term, starting from the rarest term
+        candidates = None
+        for term in sorted(set(terms), key=lambda t: len(self.term_ids[t])):
+            candidates = self.term(term) if candidates is None else candidates.intersection(self.term_ids[term])
+            if not candidates:
+                return set()
+
+        matches = set()
+        for document_id in candidates:
+            starts = set(self._positions(terms[0], document_id))
+            for offset, term in enumerate(terms[1:], start=1):
+                starts.intersection_update(p - offset for p in self._positions(term, document_id))
+                if not starts:
+                    break
+            if starts:
+                matches.add(document_id)
+        return matches
+
+    def search(self, query: str) -> List[int]:
+        """
+        Finds the documents matching a query
+
+        Parameters:
+            query (str): Query, see the class docstring
+
+        Returns:
+            List[int]: Sorted ids of matching documents
+        """
+
+        clauses: List[List[Set[int]]] = [[]]
+        for quoted, word in QUERY_TOKEN_REGEX.findall(query):
+            if word == "OR":
+                clauses.append([])
+                continue
+            if word == "AND":
+                continue
+
+            if word.endswith("*") and len(word) > 1:
+                terms = tokenize(word[:-1])
+                if len(terms) == 1:
+                    clauses[-1].append(self.prefix(terms[0]))
+                    continue
+            terms = tokenize(quoted if not word else word)
+            if terms:
+                clauses[-1].append(self.phrase(terms))
+
+        document_ids = set()
+        for clause in clauses:
+            if not clause:
+                continue
+            clause.sort(key=len)
+            clause_ids = clause[0]
+            for ids in clause[1:]:
+                if not clause_ids:
+                    break
+                clause_ids = clause_ids & ids
+            document_ids |= clause_ids
+        return sorted(document_ids)
@@ -0,0 +1,96 @@
+import contextlib
+import math
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+@contextlib.contextmanager
+def timed(timings: Optional[Dict[str, float]], stage: str):
+    """
+    Context manager that adds the time spent inside it to timings[stage], in seconds.
+    Does nothing if timings is None, so callers can leave it in place when not profiling.
+
+    Parameters:
+        timings (Optional[Dict[str, float]]): Dictionary to record the time in
+        stage (str): Name of the stage being timed
+    """
+
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Returns the peak resident set size of this process so far, or None if the platform can't tell us
+
+    Returns:
+        Optional[int]: Peak RSS in bytes
+    """
+
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    Returns the given percentile of an already sorted list, interpolating between neighbouring values
+
+    Parameters:
+        sorted_values (List[float]): Values in ascending order
+        percent (float): Percentile to compute, from 0 to 100
+
+    Returns:
+        float: The percentile
+    """
+
+    if not sorted_values:
+        return 0.0
+
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_stages(timings_list: Iterable[Dict[str, float]],
+                     percents: Iterable[float] = (50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """
+    Summarizes the time spent in each stage across many timings dictionaries (see timed)
+
+    Parameters:
+        timings_list (Iterable[Dict[str, float]]): One timings dictionary per item processed
+        percents (Iterable[float]): Percentiles to include in the summary
+
+    Returns:
+        Dict[str, Dict[str, float]]: For each stage: count, total, mean, max and the requested percentiles
+    """
+
+    stage_values = {}
+    for timings in timings_list:
+        for stage, seconds in timings.items():
+            stage_values.setdefault(stage, []).append(seconds)
+
+    summary = {}
+    for stage, values in stage_values.items():
+        values.sort()
+        summary[stage] = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values),
+                          "max": values[-1]}
+        for percent in percents:
+            summary[stage][f"p{percent:g}"] = percentile(values, percent)
+
+    return summary